@@ -0,0 +1,8 @@
+"""RapidKeys backend.
+
+Loads ``.env`` once, before any module reads its settings, whichever entry
+point (the API, a benchmark, ``python -m app.migrate``) imports the package.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
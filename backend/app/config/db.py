@@ -1,17 +1,128 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from functools import cached_property
+from typing import Optional
 import os
+import time
+from app.utils import metrics
 
-load_dotenv()
+# Pool sizing is per worker process
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
 
-engine = create_engine(
-    os.getenv("DB_URL"),
-    pool_size=5,          # per-process
-    max_overflow=10,      # burst headroom
-    pool_pre_ping=True,   # drop dead conns
-    pool_recycle=1800     # recycle every 30m
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_db_url(db_url: str):
+    """Derive the async driver URL from the sync DB_URL unless ASYNC_DB_URL is set"""
+    url = make_url(os.getenv("ASYNC_DB_URL") or db_url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    # asyncpg takes "ssl" rather than libpq's "sslmode"
+    if url.drivername == "postgresql+asyncpg" and "sslmode" in url.query:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return url
+
+DB_POOL_CHECKOUT_SECONDS = metrics.Histogram(
+    "rapidkeys_db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection", ["engine"]
+)
+
+def timed_pool(pool_class, engine_name: str):
+    """Pool class that records how long each checkout waited"""
+    waits = DB_POOL_CHECKOUT_SECONDS.labels(engine_name)
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                waits.observe(time.perf_counter() - start)
+
+    return TimedPool
+
+class Database:
+    """Engines and session factories, created on first use.
+
+    Building an engine loads the DB driver, so nothing is created at import
+    time; the first session (or the readiness check) pays for it instead.
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        self._url = url
+
+    @property
+    def url(self) -> str:
+        url = self._url or os.getenv("DB_URL")
+        if not url:
+            raise ValueError("DB_URL is not set")
+        return url
+
+    @cached_property
+    def engine(self):
+        return create_engine(
+            self.url,
+            pool_size=POOL_SIZE,          # per-process
+            max_overflow=MAX_OVERFLOW,    # burst headroom
+            pool_pre_ping=True,   # drop dead conns
+            pool_recycle=1800,    # recycle every 30m
+            poolclass=timed_pool(QueuePool, "sync")
+        )
+
+    @cached_property
+    def async_engine(self):
+        # Used by async routes so DB work does not block the event loop
+        return create_async_engine(
+            get_async_db_url(self.url),
+            pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", POOL_SIZE)),
+            max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", MAX_OVERFLOW)),
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            poolclass=timed_pool(AsyncAdaptedQueuePool, "async")
+        )
+
+    @cached_property
+    def session_factory(self):
+        return sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+    @cached_property
+    def async_session_factory(self):
+        return async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+
+    def created_engines(self):
+        """(name, engine) for the engines that exist so far"""
+        for name, attr in (("sync", "engine"), ("async", "async_engine")):
+            if attr in self.__dict__:
+                yield name, self.__dict__[attr]
+
+    async def dispose(self):
+        """Close pooled connections; engines are rebuilt if used again"""
+        for name, engine in list(self.created_engines()):
+            if name == "async":
+                await engine.dispose()
+            else:
+                engine.dispose()
+        for attr in ("engine", "async_engine", "session_factory", "async_session_factory"):
+            self.__dict__.pop(attr, None)
+
+database = Database()
+
+def SessionLocal():
+    return database.session_factory()
+
+def AsyncSessionLocal():
+    return database.async_session_factory()
+
+Base = declarative_base()
+
+DB_POOL_CHECKED_OUT = metrics.Gauge(
+    "rapidkeys_db_pool_checked_out", "DB connections currently checked out", ["engine"],
+    function=lambda: {(name,): engine.pool.checkedout() for name, engine in database.created_engines()}
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
@@ -1,195 +1,629 @@
 import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+import functools
 import os
-from dotenv import load_dotenv
-import json
-from typing import Optional, Dict, Any, List
+from contextvars import ContextVar
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from app.config.redis_scripts import SCRIPTS
+from app.utils import codec, metrics, profiling
 
-load_dotenv()
+REDIS_METHOD_SECONDS = metrics.Histogram(
+    "rapidkeys_redis_method_seconds", "RedisManager call duration by method (count is the number of calls)", ["method"]
+)
+REDIS_METHOD_ERRORS = metrics.Counter(
+    "rapidkeys_redis_method_errors_total", "RedisManager calls that raised, by method", ["method"]
+)
+REDIS_ROUND_TRIPS = metrics.Histogram(
+    "rapidkeys_redis_round_trips", "Requests sent to Redis per RedisManager call, by method", ["method"],
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32)
+)
+_time_call = metrics.time_calls(REDIS_METHOD_SECONDS, REDIS_METHOD_ERRORS)
+
+# Round trips of the outermost RedisManager call running in this task
+_round_trips: ContextVar[Optional[List[int]]] = ContextVar("redis_round_trips", default=None)
+
+class _RoundTripCounting:
+    """Connection mixin counting writes to Redis: one per command or pipeline"""
+
+    async def send_packed_command(self, command, check_health: bool = True):
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+        return await super().send_packed_command(command, check_health)
+
+def _timed(method):
+    """Record a RedisManager method in the metrics and the handler's redis phase"""
+    timed = profiling.timed_phase("redis")(_time_call(method))
+    round_trips = REDIS_ROUND_TRIPS.labels(method.__name__)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _round_trips.get() is not None:
+            # Called from another method; its round trips count towards that one
+            return await timed(*args, **kwargs)
+        counter = [0]
+        token = _round_trips.set(counter)
+        try:
+            return await timed(*args, **kwargs)
+        finally:
+            _round_trips.reset(token)
+            round_trips.observe(counter[0])
+    return wrapper
+
+def connection_pool(redis_url: str) -> redis.BlockingConnectionPool:
+    """Shared pool sized by REDIS_MAX_CONNECTIONS; callers wait up to
+    REDIS_POOL_TIMEOUT for a free connection instead of opening more"""
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url,
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 5)),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 5)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 5)),
+        socket_keepalive=True,
+        # PING connections idle this long before reuse, so a dropped one
+        # fails over here rather than on a user's request
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+    )
+    # from_url picks the (TLS or plain) connection class; count on top of it
+    pool.connection_class = type(
+        pool.connection_class.__name__, (_RoundTripCounting, pool.connection_class), {}
+    )
+    return pool
 
 class RedisManager:
-    def __init__(self):
-        redis_url = os.getenv("REDIS_CLOUD_URL")
-        if redis_url:
-            self.redis_client = redis.from_url(
-                redis_url,
-                decode_responses=True,
-                socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 5)),
-            )
-        else:
-            raise ValueError("REDIS_CLOUD_URL is not set")
-        
+    def __init__(self, redis_url: Optional[str] = None):
+        self._redis_url = redis_url
+        self._client = None
+        self._registered_scripts = None
+
+    @property
+    def redis_client(self) -> redis.Redis:
+        """The pooled client, created on first use; no connection is opened until a command runs"""
+        if self._client is None:
+            redis_url = self._redis_url or os.getenv("REDIS_CLOUD_URL")
+            if not redis_url:
+                raise ValueError("REDIS_CLOUD_URL is not set")
+            self._client = redis.Redis(connection_pool=connection_pool(redis_url))
+        return self._client
+
+    @redis_client.setter
+    def redis_client(self, client: redis.Redis):
+        self._client = client
+
+    @property
+    def _scripts(self):
+        if self._registered_scripts is None:
+            self._registered_scripts = {
+                name: self.redis_client.register_script(source) for name, source in SCRIPTS.items()
+            }
+        return self._registered_scripts
+
+    async def close(self):
+        """Close the pool's connections; a later command reconnects"""
+        if self._client is not None:
+            await self._client.aclose(close_connection_pool=True)
+
     async def test_connection(self):
         """Test Redis connection"""
         try:
             await self.redis_client.ping()
+            await self.load_scripts()
             print("✅ Redis connection established")
             return True
         except Exception as e:
             print(f"❌ Failed to connect to Redis: {e}")
             return False
 
+    async def load_scripts(self):
+        """Preload the Lua scripts so the first call of each is a plain EVALSHA"""
+        for source in SCRIPTS.values():
+            await self.redis_client.script_load(source)
+
+    async def _run_script(self, name: str, keys: List[str], args: List[Any]):
+        # Scripts fall back to EVAL (and cache the script) after a Redis restart
+        return await self._scripts[name](keys=keys, args=args, client=self.redis_client)
+
+    def _pipeline(self, transaction: bool = False):
+        """Commands queued on the pipeline go out together in one round trip.
+
+        With ``transaction`` they also run as one MULTI/EXEC block; scripts are
+        already atomic, so they are only queued on non-transactional pipelines.
+        """
+        return self.redis_client.pipeline(transaction=transaction)
+
+    def _queue_script(self, pipe, name: str, keys: List[str], args: List[Any]):
+        # Plain EVALSHA; unlike script objects on a pipeline this does not
+        # cost an extra SCRIPT EXISTS round trip per execute
+        pipe.evalsha(self._scripts[name].sha, len(keys), *keys, *args)
+
+    async def _execute(self, pipe) -> List[Any]:
+        """Send a pipeline, reloading the scripts and replaying it once if Redis lost them"""
+        commands = list(pipe.command_stack)
+        try:
+            return await pipe.execute()
+        except NoScriptError:
+            # Redis restarted or flushed its script cache, so every EVALSHA in
+            # the pipeline failed together; its other commands are reads or
+            # idempotent and safe to send again
+            await self.load_scripts()
+            retry = self._pipeline(pipe.is_transaction)
+            retry.command_stack = commands
+            return await retry.execute()
+
+    @staticmethod
+    def _flatten_fields(data: Dict[str, Any]) -> List[Any]:
+        return [item for field, value in data.items() for item in (field, codec.dumps(value))]
+
+    # Room schema
+    #
+    #   room:{code}                 hash  - scalar race fields (code, creator_id, created_at,
+    #                                       race_started, race_start_time, text, user_count,
+    #                                       next_slot)
+    #   room:{code}:settings        hash  - mode / value / difficulty
+    #   room:{code}:messages        list  - chat history, capped at CHAT_HISTORY_LIMIT
+    #   room:{code}:members         zset  - user ids scored by join time (keeps join order)
+    #   room:{code}:user:{user_id}  hash  - per-user state (username, wpm, progress, slot, ...)
+    #   rooms:index                 zset  - every room code scored by creation time
+    #   rooms:index:mode:{mode}     zset  - the same, per game mode
+    #   rooms:activity              zset  - every room code scored by last activity
+    #
+    # Every hash field holds a JSON-encoded value so types survive the round trip
+    # and a single field (e.g. progress) can be rewritten on its own.
+
+    ROOM_TTL = 86400  # 24 hours
+    ROOM_SCALAR_FIELDS = ("code", "creator_id", "created_at", "race_started", "race_start_time", "text")
+    CHAT_HISTORY_LIMIT = 100
+    ROOM_INDEX_KEY = "rooms:index"
+    ROOM_ACTIVITY_KEY = "rooms:activity"
+    ROOM_MODES = ("time", "words")
+    ROOM_SUMMARY_FIELDS = ("code", "created_at", "race_started", "user_count")
+
+    @staticmethod
+    def _room_key(room_code: str) -> str:
+        return f"room:{room_code}"
+
+    @staticmethod
+    def _settings_key(room_code: str) -> str:
+        return f"room:{room_code}:settings"
+
+    @staticmethod
+    def _messages_key(room_code: str) -> str:
+        return f"room:{room_code}:messages"
+
+    @staticmethod
+    def _members_key(room_code: str) -> str:
+        return f"room:{room_code}:members"
+
+    @staticmethod
+    def _user_key(room_code: str, user_id: str) -> str:
+        return f"room:{room_code}:user:{user_id}"
+
+    @classmethod
+    def _mode_index_key(cls, mode: str) -> str:
+        return f"{cls.ROOM_INDEX_KEY}:mode:{mode}"
+
+    def _touch_room(self, pipe, room_code: str):
+        """Queue a last-activity bump for the room reaper"""
+        pipe.zadd(self.ROOM_ACTIVITY_KEY, {room_code: time.time()})
+
+    @staticmethod
+    def _encode_fields(data: Dict[str, Any]) -> Dict[str, bytes]:
+        return {field: codec.dumps(value) for field, value in data.items()}
+
+    @staticmethod
+    def _decode_fields(data: Dict[str, str]) -> Dict[str, Any]:
+        return {field: codec.loads(value) for field, value in data.items()}
+
+    @staticmethod
+    def _decode_pairs(flat: List[str]) -> Dict[str, Any]:
+        """Decode a flat field/value list as returned by HGETALL inside a script"""
+        return {flat[i]: codec.loads(flat[i + 1]) for i in range(0, len(flat), 2)}
+
     # Room management
+    @_timed
     async def create_room(self, room_code: str, room_data: Dict[str, Any]) -> bool:
         """Create a new room with initial data"""
-        key = f"room:{room_code}"
-        result = await self.redis_client.hset(key, mapping={
-            "data": json.dumps(room_data),
-            "created_at": room_data.get("created_at", ""),
-            "user_count": 0
-        })
-        # Set expiry for room (24 hours)
-        await self.redis_client.expire(key, 86400)
-        return result
+        key = self._room_key(room_code)
+        scalars = {field: room_data[field] for field in self.ROOM_SCALAR_FIELDS if field in room_data}
+        scalars["user_count"] = 0
 
+        pipe = self._pipeline(transaction=True)
+        pipe.hset(key, mapping=self._encode_fields(scalars))
+        pipe.expire(key, self.ROOM_TTL)
+        if room_data.get("settings"):
+            pipe.hset(self._settings_key(room_code), mapping=self._encode_fields(room_data["settings"]))
+            pipe.expire(self._settings_key(room_code), self.ROOM_TTL)
+        created = time.time()
+        pipe.zadd(self.ROOM_INDEX_KEY, {room_code: created})
+        pipe.zadd(self.ROOM_ACTIVITY_KEY, {room_code: created})
+        mode = room_data.get("settings", {}).get("mode")
+        # Only indexes the delete scripts know about, so none is left behind
+        if mode in self.ROOM_MODES:
+            pipe.zadd(self._mode_index_key(mode), {room_code: created})
+        result = await self._execute(pipe)
+
+        for user_id, user_data in room_data.get("users", {}).items():
+            await self.add_user_to_room(room_code, user_id, user_data)
+        return result[0]
+
+    @_timed
     async def get_room(self, room_code: str) -> Optional[Dict[str, Any]]:
-        """Get room data"""
-        key = f"room:{room_code}"
-        room_data = await self.redis_client.hget(key, "data")
-        if room_data:
-            return json.loads(room_data)
-        return None
+        """Get room data composed from the room's keys"""
+        return self._parse_room(await self._run_script("get_room", self._get_room_keys(room_code), []))
 
-    async def update_room(self, room_code: str, room_data: Dict[str, Any]) -> bool:
-        """Update room data"""
-        key = f"room:{room_code}"
-        result = await self.redis_client.hset(key, "data", json.dumps(room_data))
-        # Redis hset returns 0 if field was updated, 1 if field was created
-        # For our purposes, both cases are successful
-        return True
+    def _get_room_keys(self, room_code: str) -> List[str]:
+        return [self._room_key(room_code), self._settings_key(room_code), self._members_key(room_code)]
 
+    def _parse_room(self, result: List[Any]) -> Optional[Dict[str, Any]]:
+        """Build room data from a get_room script result"""
+        scalars, settings, member_ids, user_hashes = result
+        if not scalars:
+            return None
+
+        users = {}
+        for user_id, user_data in zip(member_ids, user_hashes):
+            if user_data:
+                users[user_id] = self._decode_pairs(user_data)
+
+        room_data = self._decode_pairs(scalars)
+        room_data.pop("user_count", None)
+        room_data.pop("next_slot", None)
+        room_data.setdefault("race_started", False)
+        room_data.setdefault("text", None)
+        room_data["settings"] = self._decode_pairs(settings)
+        room_data["users"] = users
+        return room_data
+
+    @_timed
     async def delete_room(self, room_code: str) -> bool:
         """Delete a room"""
-        key = f"room:{room_code}"
-        result = await self.redis_client.delete(key)
+        result = await self._run_script("delete_room", self._room_keys(room_code) + self._mode_index_keys(), [
+            room_code
+        ])
         return result > 0
 
+    def _room_keys(self, room_code: str) -> List[str]:
+        """Keys every room-deleting script needs, in script order"""
+        return [
+            self._room_key(room_code),
+            self._settings_key(room_code),
+            self._messages_key(room_code),
+            self._members_key(room_code),
+            self.ROOM_INDEX_KEY,
+            self.ROOM_ACTIVITY_KEY,
+        ]
+
+    @classmethod
+    def _mode_index_keys(cls) -> List[str]:
+        """Every per-mode index; a deleted room is removed from all of them"""
+        return [cls._mode_index_key(mode) for mode in cls.ROOM_MODES]
+
+    def _unindex_room(self, pipe, room_code: str, mode: Optional[str]):
+        pipe.zrem(self.ROOM_INDEX_KEY, room_code)
+        pipe.zrem(self.ROOM_ACTIVITY_KEY, room_code)
+        if mode:
+            pipe.zrem(self._mode_index_key(mode), room_code)
+
+    @_timed
     async def room_exists(self, room_code: str) -> bool:
         """Check if room exists"""
-        key = f"room:{room_code}"
+        key = self._room_key(room_code)
         result = await self.redis_client.exists(key)
         return result > 0
 
     # User management
+    @_timed
     async def add_user_to_room(self, room_code: str, user_id: str, user_data: Dict[str, Any]) -> bool:
-        """Add user to room"""
-        room_data = await self.get_room(room_code)
-        if room_data:
-            room_data["users"][user_id] = user_data
-            await self.update_room(room_code, room_data)
-            
-            # Update user count
-            await self.redis_client.hset(f"room:{room_code}", "user_count", len(room_data["users"]))
-            
-            # Track user's current room
-            await self.redis_client.set(f"user_room:{user_id}", room_code, ex=3600)  # 1 hour expiry
-            return True
-        return False
+        """Add user to room and track the user's current room"""
+        user_count = await self._run_script("add_user", *self._add_user_args(room_code, user_id, user_data))
+        return user_count >= 0
+
+    @_timed
+    async def join_room(self, room_code: str, user_id: str, user_data: Dict[str, Any],
+                        history: int = 0) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Add user to room, then read back the room and its last ``history``
+        chat messages, all in one round trip. The room is None if it is gone."""
+        pipe = self._pipeline()
+        self._queue_script(pipe, "add_user", *self._add_user_args(room_code, user_id, user_data))
+        self._queue_script(pipe, "get_room", self._get_room_keys(room_code), [])
+        if history > 0:
+            pipe.lrange(self._messages_key(room_code), -history, -1)
+        user_count, room, *messages = await self._execute(pipe)
+        if user_count < 0:
+            return None, []
+        return self._parse_room(room), [codec.loads(message) for message in (messages[0] if messages else [])]
 
+    def _add_user_args(self, room_code: str, user_id: str, user_data: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        return [
+            self._room_key(room_code),
+            self._members_key(room_code),
+            self._user_key(room_code, user_id),
+            f"user_room:{user_id}",
+            self.ROOM_ACTIVITY_KEY,
+        ], [
+            user_id, room_code, time.time(), self.ROOM_TTL, 3600,  # user_room expires after 1 hour
+            *self._flatten_fields(user_data)
+        ]
+
+    @_timed
     async def remove_user_from_room(self, room_code: str, user_id: str) -> Optional[Dict[str, Any]]:
         """Remove user from room and return updated room data"""
-        room_data = await self.get_room(room_code)
-        if room_data and user_id in room_data["users"]:
-            user_data = room_data["users"].pop(user_id)
-            
-            # If room is empty, delete it
-            if not room_data["users"]:
-                await self.delete_room(room_code)
-                await self.redis_client.delete(f"user_room:{user_id}")
-                return None
-            else:
-                await self.update_room(room_code, room_data)
-                await self.redis_client.hset(f"room:{room_code}", "user_count", len(room_data["users"]))
-                await self.redis_client.delete(f"user_room:{user_id}")
-                return room_data
-        return None
+        # Read the room back in the same round trip; it runs after the removal
+        pipe = self._pipeline()
+        self._queue_script(pipe, "remove_user", [
+            *self._room_keys(room_code),
+            self._user_key(room_code, user_id),
+            f"user_room:{user_id}",
+            *self._mode_index_keys(),
+        ], [user_id, room_code, time.time()])
+        self._queue_script(pipe, "get_room", self._get_room_keys(room_code), [])
+        user_count, room = await self._execute(pipe)
 
+        # The user was not in the room, or it was the last one and the room is gone
+        if user_count <= 0:
+            return None
+        return self._parse_room(room)
+
+    @_timed
     async def get_user_room(self, user_id: str) -> Optional[str]:
         """Get the room code the user is currently in"""
         return await self.redis_client.get(f"user_room:{user_id}")
 
+    @_timed
+    async def get_room_user(self, room_code: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a single user's data in a room"""
+        user_data = await self.redis_client.hgetall(self._user_key(room_code, user_id))
+        return self._decode_fields(user_data) if user_data else None
+
     # User data management
+    @_timed
     async def update_user_in_room(self, room_code: str, user_id: str, user_data: dict) -> bool:
         """Update specific user data in a room"""
         try:
-            room_key = f"room:{room_code}"
-            user_key = f"users.{user_id}"
-            
-            # Update the user data in the room
-            await self.redis_client.hset(room_key, user_key, json.dumps(user_data))
-            return True
+            return bool(await self._update_users(room_code, {user_id: user_data}))
         except Exception as e:
             return False
 
+    async def _update_users(self, room_code: str, data_by_user: Dict[str, Dict[str, Any]]) -> List[str]:
+        return await self._run_script("update_users", *self._update_users_args(room_code, data_by_user))
+
+    def _update_users_args(self, room_code: str, data_by_user: Dict[str, Dict[str, Any]]) -> Tuple[List[str], List[Any]]:
+        args = [room_code, time.time()]
+        for user_id, user_data in data_by_user.items():
+            args += [user_id, len(user_data), *self._flatten_fields(user_data)]
+        return [
+            self._room_key(room_code),
+            self._members_key(room_code),
+            self.ROOM_ACTIVITY_KEY,
+        ], args
+
     # Chat management
+    @_timed
     async def add_message_to_room(self, room_code: str, message: Dict[str, Any]) -> bool:
         """Add a chat message to room"""
-        room_data = await self.get_room(room_code)
-        if room_data:
-            room_data["messages"].append(message)
-            # Keep only last 100 messages to prevent memory bloat
-            if len(room_data["messages"]) > 100:
-                room_data["messages"] = room_data["messages"][-100:]
-            return await self.update_room(room_code, room_data)
-        return False
+        key = self._messages_key(room_code)
+        # Push and trim atomically so the list never grows past the cap
+        pipe = self._pipeline(transaction=True)
+        pipe.rpush(key, codec.dumps(message))
+        pipe.ltrim(key, -self.CHAT_HISTORY_LIMIT, -1)
+        pipe.expire(key, self.ROOM_TTL)
+        self._touch_room(pipe, room_code)
+        await self._execute(pipe)
+        return True
+
+    @_timed
+    async def get_messages(self, room_code: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get up to ``limit`` messages, oldest first, skipping the ``offset`` most recent"""
+        if limit <= 0:
+            return []
+        messages = await self.redis_client.lrange(
+            self._messages_key(room_code), -(offset + limit), -(offset + 1)
+        )
+        return [codec.loads(message) for message in messages]
 
+    @_timed
     async def update_user_progress(self, room_code: str, user_id: str, progress: int, wpm: int, accuracy: float) -> bool:
         """Update user's typing progress"""
-        room_data = await self.get_room(room_code)
-        if room_data:
-            if user_id in room_data["users"]:
-                room_data["users"][user_id]["progress"] = progress
-                room_data["users"][user_id]["wpm"] = wpm
-                room_data["users"][user_id]["accuracy"] = accuracy
-                result = await self.update_room(room_code, room_data)
-                return result
-            else:
-                return False
-        return False
+        return await self.update_user_in_room(room_code, user_id, {
+            "progress": progress,
+            "wpm": wpm,
+            "accuracy": accuracy
+        })
+
+    @_timed
+    async def update_users_progress(self, room_code: str, progress_by_user: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Write a batch of progress updates and return the user ids that were stored"""
+        if not progress_by_user:
+            return []
+        return await self._update_users(room_code, progress_by_user)
 
+    @_timed
     async def update_user_ready_status(self, room_code: str, user_id: str, ready: bool) -> Optional[Dict[str, Any]]:
         """Update user's ready status and return updated room data"""
-        room_data = await self.get_room(room_code)
-        if room_data and user_id in room_data["users"]:
-            room_data["users"][user_id]["ready"] = ready
-            await self.update_room(room_code, room_data)
-            return room_data
+        if await self.update_user_in_room(room_code, user_id, {"ready": ready}):
+            return await self.get_room(room_code)
         return None
 
-    async def start_race(self, room_code: str, start_time: str) -> bool:
-        """Mark race as started"""
-        room_data = await self.get_room(room_code)
-        if room_data:
-            room_data["race_started"] = True
-            room_data["race_start_time"] = start_time
-            return await self.update_room(room_code, room_data)
-        return False
-
-    async def set_words(self, room_code: str, words: list[str]) -> bool:
-        """Set words for the room"""
-        room_data = await self.get_room(room_code)
-        if room_data:
-            room_data["words"] = words
-            return await self.update_room(room_code, room_data)
-        return False
-    
+    @_timed
+    async def start_race(self, room_code: str, start_time: str, text: Optional[Dict[str, Any]] = None) -> bool:
+        """Mark race as started, setting the text spec in the same write if given"""
+        fields = {"race_started": True, "race_start_time": start_time}
+        if text is not None:
+            fields["text"] = text
+        return await self._update_room_fields(room_code, fields)
+
+    async def _update_room_fields(self, room_code: str, fields: Dict[str, Any]) -> bool:
+        result = await self._run_script("update_room_fields", [
+            self._room_key(room_code),
+            self.ROOM_ACTIVITY_KEY,
+        ], [room_code, time.time(), *self._flatten_fields(fields)])
+        return result == 1
+
     # Connection tracking
+    @_timed
     async def track_connection(self, user_id: str, connection_id: str):
         """Track active WebSocket connection"""
         await self.redis_client.set(f"connection:{user_id}", connection_id, ex=3600)
 
+    @_timed
     async def remove_connection(self, user_id: str):
         """Remove connection tracking"""
         await self.redis_client.delete(f"connection:{user_id}")
 
-    async def get_active_rooms(self) -> List[str]:
-        """Get list of all active room codes"""
-        keys = await self.redis_client.keys("room:*")
-        return [key.split(":", 1)[1] for key in keys]
+    @_timed
+    async def get_active_rooms(self, limit: int = 20, cursor: Optional[str] = None,
+                               mode: Optional[str] = None, joinable: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of room summaries, newest first, and the cursor for the next page.
+
+        The cursor is the "score:code" of the last room returned. Rooms whose
+        keys have expired are dropped from the index as they are found.
+        """
+        index_key = self._mode_index_key(mode) if mode else self.ROOM_INDEX_KEY
+        max_score, after_code = "+inf", None
+        if cursor:
+            score, _, after_code = cursor.partition(":")
+            max_score = float(score)
+
+        rooms = []
+        batch_size = max(limit, 20)
+        while True:
+            entries = await self.redis_client.zrevrangebyscore(
+                index_key, max_score, "-inf", start=0, num=batch_size, withscores=True
+            )
+            exhausted = len(entries) < batch_size
+            # Rooms created in the same instant are returned in reverse code order
+            if after_code is not None:
+                entries = [(code, score) for code, score in entries
+                           if score < max_score or code < after_code]
+            if not entries:
+                return rooms, None
+
+            pipe = self._pipeline()
+            for code, _ in entries:
+                pipe.hmget(self._room_key(code), self.ROOM_SUMMARY_FIELDS)
+                pipe.hmget(self._settings_key(code), ("mode", "value"))
+            results = await self._execute(pipe)
+
+            stale = []
+            for i, (code, score) in enumerate(entries):
+                summary, settings = results[2 * i], results[2 * i + 1]
+                if summary[0] is None:
+                    stale.append(code)
+                    continue
+                room = {field: codec.decode(value)
+                        for field, value in zip(self.ROOM_SUMMARY_FIELDS, summary)}
+                if joinable and room["race_started"]:
+                    continue
+                room["race_started"] = bool(room["race_started"])
+                room["user_count"] = room["user_count"] or 0
+                room["settings"] = {field: codec.decode(value)
+                                    for field, value in zip(("mode", "value"), settings)}
+                rooms.append(room)
+                if len(rooms) == limit:
+                    await self._drop_stale_rooms(stale, mode)
+                    return rooms, f"{score!r}:{code}"
+
+            await self._drop_stale_rooms(stale, mode)
+            if exhausted:
+                return rooms, None
+            max_score, after_code = entries[-1][1], entries[-1][0]
+
+    async def _drop_stale_rooms(self, room_codes: List[str], mode: Optional[str]):
+        if not room_codes:
+            return
+        pipe = self._pipeline()
+        for room_code in room_codes:
+            self._unindex_room(pipe, room_code, mode)
+        await self._execute(pipe)
+
+    @_timed
+    async def cleanup_expired_rooms(self, idle_timeout: float, finished_timeout: float,
+                                    batch_size: int = 100) -> Dict[str, int]:
+        """Reclaim idle rooms and dangling user/connection keys, returning sweep counts.
+
+        Rooms whose race has started are reclaimed after ``finished_timeout``
+        seconds without activity, lobbies after ``idle_timeout``.
+        """
+        stats = {"rooms_reaped": 0, "index_entries_removed": 0, "user_keys_removed": 0, "connection_keys_removed": 0}
+        now = time.time()
+        cutoff = now - min(idle_timeout, finished_timeout)
+        offset = 0
+        while True:
+            candidates = await self.redis_client.zrangebyscore(
+                self.ROOM_ACTIVITY_KEY, "-inf", cutoff, start=offset, num=batch_size, withscores=True
+            )
+            if not candidates:
+                break
+
+            pipe = self._pipeline()
+            for room_code, _ in candidates:
+                pipe.hget(self._room_key(room_code), "race_started")
+            race_flags = await self._execute(pipe)
+
+            # Delete the whole batch of expired rooms in one round trip; the
+            # script checks each room's activity again, since a join, chat
+            # message or progress update may have landed after the reads above
+            pipe = self._pipeline()
+            kept = 0
+            for (room_code, last_active), race_started in zip(candidates, race_flags):
+                timeout = finished_timeout if race_started and codec.loads(race_started) else idle_timeout
+                if race_started is None:
+                    # Index entry of a room whose hash is already gone
+                    args = [room_code]
+                elif last_active <= now - timeout:
+                    args = [room_code, now - timeout]
+                else:
+                    kept += 1
+                    continue
+                self._queue_script(pipe, "delete_room", self._room_keys(room_code) + self._mode_index_keys(), args)
+            results = await self._execute(pipe)
+            # The script returns how many of the room's keys it deleted: 0 when
+            # only index entries were left, -1 when the room was kept
+            stats["rooms_reaped"] += sum(1 for result in results if result > 0)
+            stats["index_entries_removed"] += sum(1 for result in results if result == 0)
+            # Reaped rooms leave the activity index, so only skip the ones kept
+            offset += kept
+            if len(candidates) < batch_size:
+                break
+
+        removed_users = await self._cleanup_dangling_user_rooms(batch_size)
+        stats["user_keys_removed"] = len(removed_users)
+        if removed_users:
+            stats["connection_keys_removed"] = await self.redis_client.delete(
+                *[f"connection:{user_id}" for user_id in removed_users]
+            )
+        return stats
+
+    async def _cleanup_dangling_user_rooms(self, batch_size: int) -> List[str]:
+        """Delete user_room keys pointing at rooms that no longer exist and return their user ids"""
+        removed = []
+        async for keys in self._scan_batches("user_room:*", batch_size):
+            pipe = self._pipeline()
+            for key in keys:
+                pipe.get(key)
+            room_codes = await self._execute(pipe)
+
+            pipe = self._pipeline()
+            for room_code in room_codes:
+                pipe.exists(self._room_key(room_code or ""))
+            exists = await self._execute(pipe)
+
+            dangling = [key for key, room_exists in zip(keys, exists) if not room_exists]
+            if dangling:
+                await self.redis_client.delete(*dangling)
+                removed.extend(key.split(":", 1)[1] for key in dangling)
+        return removed
 
-    async def cleanup_expired_rooms(self):
-        """Clean up rooms that haven't been active for a while"""
-        # This could be run periodically
-        pass
+    async def _scan_batches(self, pattern: str, batch_size: int):
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis_client.scan(cursor, match=pattern, count=batch_size)
+            if keys:
+                yield keys
+            if cursor == 0:
+                return
 
 # Global Redis manager instance
 redis_manager = RedisManager()
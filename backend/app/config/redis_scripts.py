@@ -0,0 +1,143 @@
+"""Lua scripts behind RedisManager's multi-step room operations.
+
+Each script runs atomically on the server in a single round trip, so
+concurrent joins, leaves and updates can no longer interleave. The scripts
+derive per-user keys from the room key (see the schema in
+redis_config.py), which is fine on a single Redis instance but not on a
+cluster.
+"""
+
+# Shared by the scripts that may delete a whole room
+_DELETE_ROOM = """
+local function delete_room(room_key, settings_key, messages_key, members_key, index_key, activity_key, mode_index_keys, room_code)
+    for _, user_id in ipairs(redis.call('ZRANGE', members_key, 0, -1)) do
+        redis.call('DEL', room_key .. ':user:' .. user_id)
+    end
+    local deleted = redis.call('DEL', room_key, settings_key, messages_key, members_key)
+    redis.call('ZREM', index_key, room_code)
+    redis.call('ZREM', activity_key, room_code)
+    -- Every mode's index, so cleanup does not depend on the settings hash
+    for _, mode_index_key in ipairs(mode_index_keys) do
+        redis.call('ZREM', mode_index_key, room_code)
+    end
+    return deleted
+end
+"""
+
+# KEYS: room, settings, messages, members, rooms:index, rooms:activity, mode index, ...
+# ARGV: room_code[, cutoff]
+# With a cutoff, a room active after it (per rooms:activity) is kept and -1
+# returned, so a room that saw activity since the reaper read it survives
+DELETE_ROOM = _DELETE_ROOM + """
+if ARGV[2] then
+    local last_active = redis.call('ZSCORE', KEYS[6], ARGV[1])
+    if last_active and tonumber(last_active) > tonumber(ARGV[2]) then
+        return -1
+    end
+end
+return delete_room(KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], {unpack(KEYS, 7)}, ARGV[1])
+"""
+
+# KEYS: room, members, user, user_room, rooms:activity
+# ARGV: user_id, room_code, now, room ttl, user_room ttl, field, value, ...
+# Returns the new user count, or -1 if the room does not exist. Each user gets
+# a small integer slot (stored in the user hash) that binary WebSocket frames
+# use in place of the user id; a rejoining user keeps theirs
+ADD_USER = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local slot = redis.call('HGET', KEYS[3], 'slot')
+if not slot then
+    slot = tostring(redis.call('HINCRBY', KEYS[1], 'next_slot', 1) - 1)
+end
+redis.call('DEL', KEYS[3])
+redis.call('HSET', KEYS[3], unpack(ARGV, 6))
+redis.call('HSET', KEYS[3], 'slot', slot)
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+redis.call('ZADD', KEYS[2], 'NX', ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+local count = redis.call('ZCARD', KEYS[2])
+redis.call('HSET', KEYS[1], 'user_count', count)
+redis.call('SET', KEYS[4], ARGV[2], 'EX', ARGV[5])
+redis.call('ZADD', KEYS[5], ARGV[3], ARGV[2])
+return count
+"""
+
+# KEYS: room, settings, messages, members, rooms:index, rooms:activity, user, user_room,
+#       mode index, ...
+# ARGV: user_id, room_code, now
+# Returns the remaining user count (0 means the room was deleted), or -1 if
+# the user was not in the room
+REMOVE_USER = _DELETE_ROOM + """
+if redis.call('ZREM', KEYS[4], ARGV[1]) == 0 then
+    return -1
+end
+redis.call('DEL', KEYS[7])
+-- Leave the pointer alone if the user has already moved to another room
+if redis.call('GET', KEYS[8]) == ARGV[2] then
+    redis.call('DEL', KEYS[8])
+end
+local count = redis.call('ZCARD', KEYS[4])
+if count == 0 then
+    delete_room(KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], {unpack(KEYS, 9)}, ARGV[2])
+    return 0
+end
+redis.call('HSET', KEYS[1], 'user_count', count)
+redis.call('ZADD', KEYS[6], ARGV[3], ARGV[2])
+return count
+"""
+
+# KEYS: room, members, rooms:activity
+# ARGV: room_code, now, then per user: user_id, field count, field, value, ...
+# Only users still in the room are written; returns their ids
+UPDATE_USERS = """
+local updated = {}
+local i = 3
+while i <= #ARGV do
+    local user_id = ARGV[i]
+    local field_count = tonumber(ARGV[i + 1])
+    if field_count > 0 and redis.call('ZSCORE', KEYS[2], user_id) then
+        redis.call('HSET', KEYS[1] .. ':user:' .. user_id, unpack(ARGV, i + 2, i + 1 + 2 * field_count))
+        table.insert(updated, user_id)
+    end
+    i = i + 2 + 2 * field_count
+end
+if #updated > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+end
+return updated
+"""
+
+# KEYS: room, rooms:activity
+# ARGV: room_code, now, field, value, ...
+# Returns 1 if the room exists and was updated, otherwise 0
+UPDATE_ROOM_FIELDS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+# KEYS: room, settings, members
+# Returns {room hash, settings hash, member ids, {user hash, ...}} with each
+# hash as a flat field/value list, so a whole room is read in one round trip
+GET_ROOM = """
+local members = redis.call('ZRANGE', KEYS[3], 0, -1)
+local users = {}
+for i, user_id in ipairs(members) do
+    users[i] = redis.call('HGETALL', KEYS[1] .. ':user:' .. user_id)
+end
+return {redis.call('HGETALL', KEYS[1]), redis.call('HGETALL', KEYS[2]), members, users}
+"""
+
+SCRIPTS = {
+    "get_room": GET_ROOM,
+    "delete_room": DELETE_ROOM,
+    "add_user": ADD_USER,
+    "remove_user": REMOVE_USER,
+    "update_users": UPDATE_USERS,
+    "update_room_fields": UPDATE_ROOM_FIELDS,
+}
@@ -1,24 +1,72 @@
-import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import os
-from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routes import user, multiplayer
-from app.config.db import Base, engine
+from app.config.db import database
 from app.config.redis_config import redis_manager
-from app.models.sqlalchemy_user import User
+from app.utils.room_reaper import RoomReaper
+from app.utils.stats_writer import stats_writer
+from app.utils.email_service import email_dispatcher
+from app.utils.http_client import http_client
+from app.utils.username_filter import username_filter
+from app.utils.leaderboard import leaderboard
+from app.utils import metrics
+from app.utils.profiling import profiler
 from sqlalchemy import text
 
-from app.config.db import SessionLocal
-Base.metadata.create_all(bind=engine)
+# Each readiness check gets this long before the dependency counts as down
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 2))
 
-load_dotenv()
+room_reaper = RoomReaper(redis_manager)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background tasks; on the way out stop them and close the pools.
+
+    Redis and the DB are connected on first use, so a worker starts serving
+    without waiting on either. Redis is warmed up in the background.
+    """
+    if os.getenv("DB_AUTO_MIGRATE", "0") == "1":
+        from app.migrate import migrate
+        await asyncio.to_thread(migrate)
+    app.state.ready = True
+    warmup = asyncio.create_task(redis_manager.test_connection())
+    filter_build = asyncio.create_task(username_filter.ensure_built())
+    leaderboard_build = asyncio.create_task(leaderboard.ensure_built())
+    room_reaper.start()
+    stats_writer.start()
+    email_dispatcher.start()
+    http_client.start()
+    # kill -USR2 <pid> starts/stops sampling this worker's event loop
+    profiler.install_signal_handler(asyncio.get_running_loop())
+
+    yield
+
+    # Fail readiness first so load balancers stop sending new work
+    app.state.ready = False
+    warmup.cancel()
+    filter_build.cancel()
+    leaderboard_build.cancel()
+    await room_reaper.stop()
+    await multiplayer.manager.close()
+    # Write queued game stats before the pool goes away
+    await stats_writer.stop()
+    await email_dispatcher.stop()
+    await http_client.stop()
+    await database.dispose()
+    await redis_manager.close()
+    profiler.stop()
 
 app = FastAPI(
     title="RapidKeys API",
     description="Backend API for RapidKeys typing test application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.state.ready = False
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,21 +76,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+ROOMS = metrics.Gauge("rapidkeys_rooms", "Rooms in the shared room index (all workers)")
+ROOM_REAPER = metrics.Gauge(
+    "rapidkeys_room_reaper", "Room reaper totals for this worker since start", ["stat"],
+    function=lambda: {(name,): value for name, value in room_reaper.stats.items()}
+)
 
 app.include_router(user.router, prefix="/api/v1", tags=["User"])
 app.include_router(multiplayer.router, prefix="/api/v1/multiplayer", tags=["Multiplayer"])
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize Redis connection on startup""" 
-    await redis_manager.test_connection()
-
 @app.get("/")
 async def root():
     return {"message": "Welcome to RapidKeys API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint for this worker"""
+    try:
+        ROOMS.set(await redis_manager.redis_client.zcard(redis_manager.ROOM_INDEX_KEY))
+    except Exception as e:
+        print(f"Failed to count rooms for metrics: {e}")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    """The process is up and its event loop is responsive; touches no dependencies"""
+    return {"status": "alive"}
+
+async def _check(name: str, probe) -> str:
+    try:
+        await asyncio.wait_for(probe(), timeout=READINESS_TIMEOUT)
+        return "ok"
+    except Exception as e:
+        print(f"Readiness check {name} failed: {e!r}")
+        return "unavailable"
+
+async def _ping_db():
+    async with database.async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness():
+    """Whether this worker can serve traffic: started, not shutting down, Redis and DB reachable"""
+    redis_status, db_status = await asyncio.gather(
+        _check("redis", lambda: redis_manager.redis_client.ping()),
+        _check("db", _ping_db)
+    )
+    checks = {"redis": redis_status, "db": db_status}
+    ready = app.state.ready and all(status == "ok" for status in checks.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(
         "app.main:app",
         port=int(os.getenv("PORT", 8000)),
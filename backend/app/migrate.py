@@ -0,0 +1,54 @@
+"""Create the tables for every model that does not have one yet, and bring
+older tables up to date: missing columns are added and backfilled, and
+missing indexes created (create_all only adds indexes with new tables).
+
+Run it as a deploy step, before the API starts:
+
+    python -m app.migrate
+
+The API no longer does this on import; set DB_AUTO_MIGRATE=1 to have it run
+at startup instead (handy for local development).
+"""
+from sqlalchemy import inspect, text
+
+from app.config.db import Base, database
+# Imported for their side effect of registering tables on Base.metadata
+from app.models import sqlalchemy_game_result, sqlalchemy_user  # noqa: F401
+
+
+def _add_username_lower(connection):
+    """Add and backfill users.username_lower on tables created before it existed"""
+    columns = {column["name"] for column in inspect(connection).get_columns("users")}
+    if "username_lower" not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN username_lower VARCHAR"))
+    connection.execute(text(
+        "UPDATE users SET username_lower = lower(username) "
+        "WHERE username_lower IS NULL AND username IS NOT NULL"
+    ))
+    duplicates = connection.execute(text(
+        "SELECT username_lower FROM users WHERE username_lower IS NOT NULL "
+        "GROUP BY username_lower HAVING count(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            f"Cannot add the unique username index; rename the duplicates first: {', '.join(duplicates)}"
+        )
+
+
+def _create_missing_indexes(connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def migrate():
+    Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as connection:
+        _add_username_lower(connection)
+        # After the backfill, so the unique username index can be built
+        _create_missing_indexes(connection)
+
+
+if __name__ == "__main__":
+    migrate()
+    print(f"Tables up to date: {', '.join(sorted(Base.metadata.tables))}")
@@ -0,0 +1,55 @@
+from sqlalchemy import Column, String, Integer, Float, Date, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from app.config.db import Base
+
+class GameResult(Base):
+    """One finished game; raw history behind the rollups below"""
+    __tablename__ = "game_results"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    mode = Column(String, nullable=False)
+    # Seconds for "time" games, word count for "words" games (0 if unknown)
+    submode = Column(Integer, nullable=False, default=0)
+    wpm = Column(Integer, nullable=False)
+    accuracy = Column(Float, nullable=False)
+    duration = Column(Integer, nullable=True)
+    word_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=func.now())
+
+    __table_args__ = (
+        # A user's history in one mode, newest first
+        Index("ix_game_results_user_mode_submode_created", user_id, mode, submode, created_at),
+    )
+
+class UserModeStats(Base):
+    """Per-user, per-mode totals, kept up to date as games are written"""
+    __tablename__ = "user_mode_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    mode = Column(String, primary_key=True)
+    submode = Column(Integer, primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wpm_total = Column(Float, nullable=False, default=0.0)
+    accuracy_total = Column(Float, nullable=False, default=0.0)
+    best_wpm = Column(Integer, nullable=False, default=0)
+    best_accuracy = Column(Float, nullable=False, default=0.0)
+    last_played_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Percentile of a user's best among everyone who played the mode
+        Index("ix_user_mode_stats_mode_submode_best_wpm", mode, submode, best_wpm),
+    )
+
+class UserDailyStats(Base):
+    """Per-user, per-mode totals by UTC day, for trend charts"""
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    mode = Column(String, primary_key=True)
+    submode = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wpm_total = Column(Float, nullable=False, default=0.0)
+    accuracy_total = Column(Float, nullable=False, default=0.0)
+    best_wpm = Column(Integer, nullable=False, default=0)
@@ -1,12 +1,21 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime
+from sqlalchemy import Column, String, Integer, Float, DateTime, Index
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
+from typing import Optional
 from app.config.db import Base
 
+def normalize_username(username: Optional[str]) -> Optional[str]:
+    """Form usernames are compared in (case-insensitively)"""
+    return username.lower() if username is not None else None
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, nullable=False)
+    # Kept in step with username; the unique index on it is what stops two
+    # users taking the same name, however the requests interleave
+    username_lower = Column(String, nullable=True)
     email = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=True)
     auth_provider = Column(String, nullable=False, default="credentials")
@@ -17,4 +26,15 @@ class User(Base):
     average_accuracy = Column(Float, nullable=True, default=0.0)
     created_at = Column(DateTime, nullable=False, default=func.now())
     reset_code = Column(String, nullable=True)
-    reset_code_expires = Column(DateTime, nullable=True)
\ No newline at end of file
+    reset_code_expires = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Supports the leaderboard order and rebuilds
+        Index("ix_users_best_wpm_best_accuracy", best_wpm.desc(), best_accuracy.desc()),
+        Index("ux_users_username_lower", username_lower, unique=True),
+    )
+
+    @validates("username")
+    def _normalize_username(self, key, username):
+        self.username_lower = normalize_username(username)
+        return username
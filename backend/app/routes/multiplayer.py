@@ -1,38 +1,85 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from fastapi.security import OAuth2PasswordBearer
-import json
-import jwt
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
 import os
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Union
 import uuid
+import time
 from datetime import datetime, timezone
-from app.models.sqlalchemy_user import User
-from app.config.db import SessionLocal
 from app.config.redis_config import redis_manager
 import asyncio
+import functools
 import random
 import string
-from app.utils.word_generator import generate_words
+from app.utils.word_generator import new_text_spec
+from app.utils.progress_aggregator import ProgressAggregator
+from app.utils.room_pubsub import RoomPubSub
+from app.utils import codec, metrics, profiling, ws_protocol
+from app.utils.ws_sender import ConnectionSender, LATEST_WINS
+from app.utils.auth import current_user_dependency, resolve_token
 router = APIRouter()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
+
+# Chat lines sent with room_joined; older history is paged via /room/{code}/messages
+CHAT_HISTORY_ON_JOIN = int(os.getenv("CHAT_HISTORY_ON_JOIN", 20))
+# Relay room frames between workers; single-worker deployments can turn it off
+PUBSUB_ENABLED = os.getenv("MULTIPLAYER_PUBSUB", "1") == "1"
+
+# Inbound types are client-controlled; anything else is counted as "other"
+INBOUND_TYPES = {"chat_message", "start_race", "typing_progress", "notification"}
+
+WS_CONNECTIONS = metrics.Gauge(
+    "rapidkeys_websocket_connections", "Open multiplayer sockets on this worker",
+    function=lambda: len(manager.active_connections)
+)
+WS_ROOMS = metrics.Gauge(
+    "rapidkeys_websocket_rooms", "Rooms with at least one socket on this worker",
+    function=lambda: len(manager.room_connections)
+)
+WS_FRAMES_RECEIVED = metrics.Counter(
+    "rapidkeys_websocket_frames_received_total", "Frames received from clients, by message type", ["type"]
+)
+WS_SEND_QUEUE = metrics.Gauge(
+    "rapidkeys_websocket_send_queue", "Frames (total and deepest socket) and characters waiting in send queues on this worker",
+    ["stat"],
+    function=lambda: manager.send_queue_stats()
+)
+BROADCAST_FANOUT = metrics.Histogram(
+    "rapidkeys_broadcast_fanout", "Local sockets a room frame was sent to", ["type"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+BROADCAST_SECONDS = metrics.Histogram(
+    "rapidkeys_broadcast_seconds", "Time to queue a room frame for every local socket", ["type"]
+)
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # In-process index of which local sockets belong to which room
+        self.room_connections: Dict[str, Set[str]] = {}
+        self.connection_rooms: Dict[str, str] = {}
+        # Negotiated subprotocol and binary-frame slot of each local socket
+        self.connection_protocols: Dict[str, Optional[str]] = {}
+        self.connection_slots: Dict[str, int] = {}
+        # Outbound queue and writer task of each local socket
+        self.senders: Dict[str, ConnectionSender] = {}
+        self.progress_aggregator = ProgressAggregator(
+            self._flush_progress,
+            rate_hz=float(os.getenv("PROGRESS_BROADCAST_HZ", 15))
+        )
+        self.pubsub = RoomPubSub(redis_manager, self._deliver_local) if PUBSUB_ENABLED else None
 
-    async def connect(self, websocket: WebSocket, user_id: str, room_code: str, username: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    async def connect(self, websocket: WebSocket, user_id: str, room_code: str, username: str) -> bool:
+        """Accept the socket and join it to the room; False if it was closed instead"""
+        subprotocol = ws_protocol.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
 
         room_data = await redis_manager.get_room(room_code)
         if not room_data:
             await websocket.close(code=1008, reason="Room not found")
-            return
+            return False
 
         # Check if race has already started
         if room_data.get("race_started", False):
             await websocket.close(code=1008, reason="Race already in progress")
-            return
+            return False
 
         is_host = room_data.get("creator_id") == user_id
         
@@ -47,8 +94,29 @@ class ConnectionManager:
             "is_host": is_host
         }
         
-        await redis_manager.add_user_to_room(room_code, user_id, user_data)
-        room_data = await redis_manager.get_room(room_code)
+        room_data, messages = await redis_manager.join_room(room_code, user_id, user_data, CHAT_HISTORY_ON_JOIN)
+        if not room_data:
+            await websocket.close(code=1008, reason="Room not found")
+            return False
+        user_data = room_data["users"].get(user_id, user_data)
+
+        previous = self.senders.pop(user_id, None)
+        if previous:
+            # The same user reconnected; retire the old socket
+            asyncio.create_task(previous.close())
+        sender = ConnectionSender(websocket, subprotocol, functools.partial(self._drop_connection, user_id))
+        sender.start()
+        self.senders[user_id] = sender
+        self.active_connections[user_id] = websocket
+        self.connection_protocols[user_id] = subprotocol
+        if user_data.get("slot") is not None:
+            self.connection_slots[user_id] = user_data["slot"]
+        if room_code not in self.room_connections and self.pubsub:
+            # Subscribe before the room is tracked, so a failed subscribe leaves
+            # no empty entry behind and the next join tries again
+            await self.pubsub.subscribe(room_code)
+        self.room_connections.setdefault(room_code, set()).add(user_id)
+        self.connection_rooms[user_id] = room_code
         
         # Notify room about new user
         await self.broadcast_to_room(room_code, {
@@ -58,68 +126,137 @@ class ConnectionManager:
         })
         
         # Send room state to new user
+        room_data["messages"] = messages
         await self.send_personal_message({
             "type": "room_joined",
             "room": room_data,
             "your_id": user_id
-        }, websocket)
+        }, user_id)
+        return True
 
-    def disconnect(self, user_id: str):
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            # Already dropped, or an old socket of a user who has since reconnected
+            return
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        sender = self.senders.pop(user_id, None)
+        if sender:
+            asyncio.create_task(sender.close())
+        self.connection_protocols.pop(user_id, None)
+        self.connection_slots.pop(user_id, None)
+
+        room_code = self.connection_rooms.pop(user_id, None)
+        if room_code in self.room_connections:
+            self.room_connections[room_code].discard(user_id)
+            if not self.room_connections[room_code]:
+                del self.room_connections[room_code]
+                if self.pubsub:
+                    asyncio.create_task(self.pubsub.unsubscribe(room_code))
         
         # Schedule async cleanup
         asyncio.create_task(self._async_disconnect_cleanup(user_id))
 
     async def _async_disconnect_cleanup(self, user_id: str):
-        # Get user's room from Redis
-        room_code = await redis_manager.get_user_room(user_id)
-        if room_code:
-            # Get user info before removing
-            room_data = await redis_manager.get_room(room_code)
-            username = room_data["users"].get(user_id, {}).get("username", "Unknown") if room_data else "Unknown"
-            
-            # Remove user from room in Redis
-            updated_room_data = await redis_manager.remove_user_from_room(room_code, user_id)
-            
-            # If room still exists, notify remaining users
-            if updated_room_data:
-                await self.broadcast_to_room(room_code, {
-                    "type": "user_left",
-                    "user_id": user_id,
-                    "username": username,
-                    "room_users": list(updated_room_data["users"].values())
-                })
+        with profiling.track("leave") as op:
+            # Get user's room from Redis
+            room_code = await redis_manager.get_user_room(user_id)
+            if op is not None:
+                op.room_code = room_code
+            if room_code:
+                # Get user info before removing
+                room_data = await redis_manager.get_room(room_code)
+                username = room_data["users"].get(user_id, {}).get("username", "Unknown") if room_data else "Unknown"
+                
+                # Remove user from room in Redis
+                updated_room_data = await redis_manager.remove_user_from_room(room_code, user_id)
+                
+                # If room still exists, notify remaining users
+                if updated_room_data:
+                    await self.broadcast_to_room(room_code, {
+                        "type": "user_left",
+                        "user_id": user_id,
+                        "username": username,
+                        "room_users": list(updated_room_data["users"].values())
+                    })
+                elif not await redis_manager.room_exists(room_code):
+                    self.progress_aggregator.discard(room_code)
+
+    def _drop_connection(self, user_id: str, sender: ConnectionSender):
+        """Disconnect a socket whose sends failed or fell too far behind"""
+        if self.senders.get(user_id) is sender:
+            print(f"Dropping connection of user {user_id}: {sender.close_reason}")
+            self.disconnect(user_id)
+
+    def send_queue_stats(self) -> Dict[tuple, int]:
+        depths = [sender.queued for sender in self.senders.values()]
+        return {
+            ("frames",): sum(depths),
+            ("max_frames",): max(depths, default=0),
+            ("bytes",): sum(sender.queued_bytes for sender in self.senders.values()),
+        }
 
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
-        try:
-            await websocket.send_text(json.dumps(message))
-        except:
-            pass
+    async def send_personal_message(self, message: dict, user_id: str):
+        with profiling.phase("serialize"):
+            text = codec.dumps_str(message)
+        sender = self.senders.get(user_id)
+        if sender is not None and sender.send(text, message["type"], message):
+            profiling.add_fanout(1)
 
     async def broadcast_to_room(self, room_code: str, message: dict):
-        room_data = await redis_manager.get_room(room_code)
-        if not room_data:
+        # Serialize once; local sockets get the frame directly and other
+        # workers get it over the room's pub/sub channel
+        with profiling.phase("serialize"):
+            payload = codec.dumps(message)
+        await self._deliver_local(room_code, payload, message["type"], message)
+        if self.pubsub:
+            try:
+                with profiling.phase("redis"):
+                    await self.pubsub.publish(room_code, payload, message["type"])
+            except Exception as e:
+                print(f"Failed to publish to room {room_code}: {e}")
+
+    async def _deliver_local(self, room_code: str, payload: Union[bytes, str], message_type: str,
+                             message: Optional[dict] = None):
+        user_ids = list(self.room_connections.get(room_code, ()))
+        if not user_ids:
             return
-            
-        disconnected_users = []
-        for user_id in room_data["users"]:
-            if user_id in self.active_connections:
-                try:
-                    await self.active_connections[user_id].send_text(json.dumps(message))
-                except:
-                    disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+        start = time.perf_counter()
+
+        with profiling.phase("serialize"):
+            # ASGI text frames take str, so decode once for the whole room
+            text = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+
+            binary_sockets = any(
+                self.connection_protocols.get(user_id) == ws_protocol.BINARY_SUBPROTOCOL for user_id in user_ids
+            )
+            if message is None and (binary_sockets or message_type in LATEST_WINS):
+                message = codec.loads(payload)
+
+            # Binary sockets get the compact frame when the message has one; it is
+            # encoded at most once per broadcast, like the JSON payload
+            frames = {None: text, ws_protocol.JSON_SUBPROTOCOL: text}
+            if binary_sockets:
+                binary = ws_protocol.encode_binary(message)
+                frames[ws_protocol.BINARY_SUBPROTOCOL] = binary if binary is not None else text
+
+        # Each socket's writer task does the actual send, so one slow client
+        # cannot hold up the rest of the room; one too far behind is dropped
+        with profiling.phase("send"):
+            for user_id in user_ids:
+                sender = self.senders.get(user_id)
+                if sender is not None:
+                    sender.send(frames[self.connection_protocols.get(user_id)], message_type, message)
+        profiling.add_fanout(len(user_ids))
+        BROADCAST_SECONDS.labels(message_type).observe(time.perf_counter() - start)
+        BROADCAST_FANOUT.labels(message_type).observe(len(user_ids))
 
     async def handle_chat_message(self, room_code: str, user_id: str, message: str):
-        room_data = await redis_manager.get_room(room_code)
-        if not room_data or user_id not in room_data["users"]:
+        user_data = await redis_manager.get_room_user(room_code, user_id)
+        if not user_data:
             return
         
-        username = room_data["users"][user_id]["username"]
+        username = user_data["username"]
         chat_message = {
             "id": str(uuid.uuid4()),
             "user_id": user_id,
@@ -145,27 +282,45 @@ class ConnectionManager:
         mode = room_data["settings"]["mode"]
         submode = room_data["settings"]["value"]
         
-        words = generate_words(mode, submode)
-        await redis_manager.set_words(room_code, words)
-        
+        # Clients rebuild the words from the seed instead of receiving the list
+        text = new_text_spec(mode, submode)
         start_time = datetime.now(timezone.utc).isoformat()
-        await redis_manager.start_race(room_code, start_time)
+        await redis_manager.start_race(room_code, start_time, text)
         
         await self.broadcast_to_room(room_code, {
             "type": "race_started",
-            "words": words,
+            "text": text,
             "start_time": start_time
         })
 
     async def handle_typing_progress(self, room_code: str, user_id: str, progress: int, wpm: int, accuracy: float):
-        if await redis_manager.update_user_progress(room_code, user_id, progress, wpm, accuracy):
-            await self.broadcast_to_room(room_code, {
-                "type": "user_progress",
-                "user_id": user_id,
-                "progress": progress,
-                "wpm": wpm,
-                "accuracy": accuracy
-            })
+        # Coalesced per room; the latest report per user goes out on the next tick
+        self.progress_aggregator.record(room_code, user_id, {
+            "progress": progress,
+            "wpm": wpm,
+            "accuracy": accuracy
+        })
+
+    async def _flush_progress(self, room_code: str, progress_by_user: Dict[str, dict]):
+        with profiling.track("progress_flush", room_code):
+            stored = await redis_manager.update_users_progress(room_code, progress_by_user)
+            if stored:
+                await self.broadcast_to_room(room_code, {
+                    "type": "progress_snapshot",
+                    "users": {
+                        user_id: {**progress_by_user[user_id], "slot": self.connection_slots.get(user_id)}
+                        for user_id in stored
+                    }
+                })
+
+    async def close(self):
+        """Stop background progress ticks, the pub/sub listener and the socket writers"""
+        await self.progress_aggregator.close()
+        if self.pubsub:
+            await self.pubsub.close()
+        senders = list(self.senders.values())
+        self.senders.clear()
+        await asyncio.gather(*(sender.close() for sender in senders))
 
     async def handle_notification(self, room_code: str, user_id: str, message: dict):
         """Handle notification messages and broadcast them to all users in the room"""
@@ -173,26 +328,6 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
-def verify_token(token: str, db):
-    try:
-        secret = os.getenv("JWT_SECRET")
-        if not secret:
-            return None
-        payload = jwt.decode(token, secret, algorithms=["HS256"])
-        user_id = payload.get("sub")
-        if not user_id:
-            return None
-        # If User.id is a UUID column, cast incoming string to UUID
-        try:
-            user_uuid = uuid.UUID(str(user_id))
-            user = db.query(User).filter(User.id == user_uuid).first()
-        except (ValueError, AttributeError):
-            # Fallback for non-UUID string primary keys
-            user = db.query(User).filter(User.id == user_id).first()
-        return user
-    except Exception:
-        return None
-
 async def generate_room_code() -> str:
     """Generate a unique 6-character room code"""
     while True:
@@ -204,57 +339,76 @@ async def generate_room_code() -> str:
 async def websocket_endpoint(websocket: WebSocket, room_code: str):
     token = websocket.query_params.get("token")
     # Verify user authentication
-    with SessionLocal() as db:
-        user = verify_token(token, db)
+    user = await resolve_token(token)
     if not user:
         await websocket.close(code=1008, reason="Invalid token")
         return
     
-    user_id = str(user.id)
+    user_id = user.id
     username = user.username
     
-    await manager.connect(websocket, user_id, room_code, username)
-    
     try:
+        with profiling.track("join", room_code):
+            if not await manager.connect(websocket, user_id, room_code, username):
+                return
+
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            received_at = time.perf_counter()
+            if frame.get("bytes") is not None:
+                try:
+                    message = ws_protocol.decode_binary(frame["bytes"])
+                except ws_protocol.ProtocolError:
+                    continue
+            else:
+                try:
+                    message = codec.loads(frame["text"])
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+            decode_seconds = time.perf_counter() - received_at
             
             message_type = message.get("type")
+            label = message_type if message_type in INBOUND_TYPES else "other"
+            WS_FRAMES_RECEIVED.labels(label).inc()
             
-            if message_type == "chat_message":
-                await manager.handle_chat_message(room_code, user_id, message.get("message", ""))
-            
-            elif message_type == "start_race":
-                await manager.handle_start_race(room_code, user_id)
-            
-            elif message_type == "typing_progress":
-                progress = message.get("progress", 0)
-                wpm = message.get("wpm", 0) 
-                accuracy = message.get("accuracy", 0)
-                await manager.handle_typing_progress(room_code, user_id, progress, wpm, accuracy)
-
-            elif message_type == "notification":
-                await manager.handle_notification(room_code, user_id, message)
+            with profiling.track(label, room_code, start=received_at):
+                profiling.record_phase("serialize", decode_seconds)
+
+                if message_type == "chat_message":
+                    await manager.handle_chat_message(room_code, user_id, message.get("message", ""))
+                
+                elif message_type == "start_race":
+                    await manager.handle_start_race(room_code, user_id)
+                
+                elif message_type == "typing_progress":
+                    fields = ws_protocol.progress_fields(message)
+                    if fields is None:
+                        continue  # Not numbers; drop the frame rather than relay it
+                    await manager.handle_typing_progress(room_code, user_id, **fields)
+
+                elif message_type == "notification":
+                    await manager.handle_notification(room_code, user_id, message)
     
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        # Also on a handler error, so the socket's writer, room entry and
+        # pub/sub subscription do not outlive it
+        manager.disconnect(user_id, websocket)
 
 @router.post("/create-room")
-async def create_room(settings: dict, token: str = Depends(oauth2_scheme)):
-    with SessionLocal() as db:
-        user = verify_token(token, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
+async def create_room(settings: dict, user: current_user_dependency):
     room_code = await generate_room_code()
     # Create room with provided settings
     room_data = {
         "code": room_code,
-        "creator_id": str(user.id),
+        "creator_id": user.id,
         "users": {},
-        "messages": [],
-        "words": [],
+        "text": None,
         "created_at": datetime.now(timezone.utc).isoformat(),
         "race_started": False,
         "settings": {
@@ -272,12 +426,7 @@ async def create_room(settings: dict, token: str = Depends(oauth2_scheme)):
     }
 
 @router.get("/room/{room_code}")
-async def get_room_info(room_code: str, token: str = Depends(oauth2_scheme)):
-    with SessionLocal() as db:
-        user = verify_token(token, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
+async def get_room_info(room_code: str, user: current_user_dependency):
     room_data = await redis_manager.get_room(room_code)
     if not room_data:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -289,34 +438,34 @@ async def get_room_info(room_code: str, token: str = Depends(oauth2_scheme)):
             "user_count": len(room_data["users"]),
             "users": list(room_data["users"].values()),
             "race_started": room_data["race_started"],
-            "words": room_data.get("words", []),
+            "text": room_data.get("text"),
             "created_at": room_data["created_at"],
             "settings": room_data.get("settings", {})
         }
     }
 
 @router.get("/active-rooms")
-async def get_active_rooms(token: str = Depends(oauth2_scheme)):
-    with SessionLocal() as db:
-        user = verify_token(token, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    active_rooms = []
-    room_codes = await redis_manager.get_active_rooms()
+async def get_active_rooms(user: current_user_dependency, limit: int = 20, cursor: Optional[str] = None,
+                           mode: Optional[str] = None, joinable: bool = False):
+    try:
+        active_rooms, next_cursor = await redis_manager.get_active_rooms(
+            limit=max(1, min(limit, 100)), cursor=cursor, mode=mode, joinable=joinable
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    for room_code in room_codes:
-        room_data = await redis_manager.get_room(room_code)
-        if room_data:
-            active_rooms.append({
-                "code": room_code,
-                "user_count": len(room_data["users"]),
-                "race_started": room_data["race_started"],
-                "words": room_data.get("words", []),
-                "created_at": room_data["created_at"]
-            })
+    return {
+        "success": True,
+        "rooms": active_rooms,
+        "next_cursor": next_cursor
+    }
+
+@router.get("/room/{room_code}/messages")
+async def get_room_messages(room_code: str, user: current_user_dependency, limit: int = 50, offset: int = 0):
+    if not await redis_manager.room_exists(room_code):
+        raise HTTPException(status_code=404, detail="Room not found")
     
     return {
         "success": True,
-        "rooms": active_rooms
+        "messages": await redis_manager.get_messages(room_code, max(1, min(limit, 100)), max(0, offset))
     }
@@ -1,30 +1,44 @@
 from fastapi import APIRouter, status, Body, Depends
 from app.models.user import UserCreate, UserLogin, UserStatsUpdate, ForgotPasswordRequest, UsernameCheck, VerifyResetCodeRequest, ResetPasswordRequest
-from app.models.sqlalchemy_user import User
+from app.models.sqlalchemy_user import User, normalize_username
+from app.models.sqlalchemy_game_result import UserModeStats, UserDailyStats
 from app.utils.db_conn import db_dependency
 import os
-from dotenv import load_dotenv
 from fastapi.responses import RedirectResponse
 import urllib.parse
-import requests
 from sqlalchemy.orm import Session
 import jwt
 from app.utils.hasher import get_password_hash, verify_password
 from app.utils.email_service import generate_reset_code, send_reset_code_email, get_reset_code_expiry
 import os
-from fastapi.security import OAuth2PasswordBearer
+from app.utils.auth import oauth2_scheme, get_token_subject, invalidate_user
+from app.utils.db_conn import async_db_dependency
+from app.utils.leaderboard import leaderboard
+from app.utils.stats_writer import stats_writer
+from app.utils.http_client import http_client
+from app.utils.username_filter import username_filter, USERNAME_CHECKS
+from anyio import from_thread
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from datetime import datetime, timedelta
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")  
-
 router = APIRouter()
 
-load_dotenv()
-
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI") 
+# Overridable so a local stub can stand in for Google (e.g. in load tests)
+GOOGLE_AUTH_URL = os.getenv("GOOGLE_AUTH_URL", "https://accounts.google.com/o/oauth2/v2/auth")
+GOOGLE_TOKEN_URL = os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+GOOGLE_USERINFO_URL = os.getenv("GOOGLE_USERINFO_URL", "https://www.googleapis.com/oauth2/v2/userinfo")
+
+# Bounds on a finished game; anything outside them is a bad client, not a record
+MAX_WPM = 500
+MAX_GAME_LENGTH = 10000  # seconds (time mode) or words (words mode)
+GAME_MODES = ("time", "words")
 
 SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
@@ -36,7 +50,12 @@ router = APIRouter()
 def signup(db: db_dependency, user: UserCreate = Body(...)):
     user = User(username=user.username, email=user.email, password=get_password_hash(user.password))
     db.add(user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return {"success": False, "error": "Username or email already exists"}
+    from_thread.run(username_filter.add, user.username_lower)
 
     token = jwt.encode(
         {"sub": str(user.id)},
@@ -50,7 +69,7 @@ def signup(db: db_dependency, user: UserCreate = Body(...)):
 
 @router.get("/auth/google")
 def google_login():
-    base_url = "https://accounts.google.com/o/oauth2/v2/auth"
+    base_url = GOOGLE_AUTH_URL
     params = {
         "client_id": GOOGLE_CLIENT_ID,
         "redirect_uri": GOOGLE_REDIRECT_URI,
@@ -63,9 +82,8 @@ def google_login():
     return RedirectResponse(url) 
 
 @router.get("/auth/google/callback")
-def google_callback(db: db_dependency, code: str):
+async def google_callback(db: async_db_dependency, code: str):
     # 1. Exchange the code for tokens
-    token_url = "https://oauth2.googleapis.com/token"
     token_data = {
         "code": code,
         "client_id": GOOGLE_CLIENT_ID,
@@ -73,22 +91,26 @@ def google_callback(db: db_dependency, code: str):
         "redirect_uri": GOOGLE_REDIRECT_URI,
         "grant_type": "authorization_code"
     }
-    token_r = requests.post(token_url, data=token_data)
-    token_json = token_r.json()
+    try:
+        token_r = await http_client.client.post(GOOGLE_TOKEN_URL, data=token_data)
+        token_json = token_r.json()
 
-    if "error" in token_json:
-        return {"error": token_json}
+        if "error" in token_json:
+            return {"error": token_json}
 
-    access_token = token_json.get("access_token")
+        access_token = token_json.get("access_token")
 
-    userinfo_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-    userinfo_r = requests.get(
-        userinfo_url,
-        headers={"Authorization": f"Bearer {access_token}"}
-    )
-    userinfo = userinfo_r.json()
+        # 2. Fetch the user's profile over the same pooled client
+        userinfo_r = await http_client.client.get(
+            GOOGLE_USERINFO_URL,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        userinfo = userinfo_r.json()
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Google OAuth request failed: {e!r}")
+        return {"error": "Could not reach Google"}
 
-    user = db.query(User).filter(User.email == userinfo["email"]).first()
+    user = (await db.execute(select(User).where(User.email == userinfo["email"]))).scalar_one_or_none()
     if not user:
         user = User(
             username=None,
@@ -97,7 +119,7 @@ def google_callback(db: db_dependency, code: str):
             password=""
         )
         db.add(user)
-        db.commit()
+        await db.commit()
 
     token = jwt.encode(
         {"sub": str(user.id)},
@@ -111,8 +133,10 @@ def google_callback(db: db_dependency, code: str):
 @router.get("/profile")
 def get_profile(db: db_dependency, token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET"), algorithms=["HS256"])
-        user = db.query(User).filter(User.id == payload["sub"]).first()
+        user_id = get_token_subject(token)
+        if not user_id:
+            return {"success": False, "error": "Invalid token"}
+        user = db.query(User).filter(User.id == user_id).first()
         
         if not user:
             return {"success": False, "error": "User not found"}
@@ -133,6 +157,70 @@ def get_profile(db: db_dependency, token: str = Depends(oauth2_scheme)):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@router.get("/profile/stats")
+async def get_profile_stats(db: async_db_dependency, days: int = 30, token: str = Depends(oauth2_scheme)):
+    try:
+        user_id = get_token_subject(token)
+        if not user_id:
+            return {"success": False, "error": "Invalid token"}
+        user_id = int(user_id)
+        
+        # Share of players in the same mode whose best is below this user's
+        others = aliased(UserModeStats)
+        below = select(func.count()).where(
+            others.mode == UserModeStats.mode,
+            others.submode == UserModeStats.submode,
+            others.best_wpm < UserModeStats.best_wpm
+        ).scalar_subquery()
+        players = select(func.count()).where(
+            others.mode == UserModeStats.mode,
+            others.submode == UserModeStats.submode
+        ).scalar_subquery()
+        modes = (await db.execute(
+            select(UserModeStats, below, players)
+            .where(UserModeStats.user_id == user_id)
+            .order_by(UserModeStats.mode, UserModeStats.submode)
+        )).all()
+        
+        since = datetime.utcnow().date() - timedelta(days=max(1, min(days, 365)) - 1)
+        trend = (await db.execute(
+            select(UserDailyStats)
+            .where(UserDailyStats.user_id == user_id, UserDailyStats.day >= since)
+            .order_by(UserDailyStats.day, UserDailyStats.mode, UserDailyStats.submode)
+        )).scalars().all()
+        
+        return {
+            "success": True,
+            "modes": [
+                {
+                    "mode": stats.mode,
+                    "submode": stats.submode,
+                    "games": stats.games,
+                    "best_wpm": stats.best_wpm,
+                    "best_accuracy": stats.best_accuracy,
+                    "average_wpm": round(stats.wpm_total / stats.games, 2),
+                    "average_accuracy": round(stats.accuracy_total / stats.games, 2),
+                    "percentile": round(100 * below_count / player_count, 1),
+                    "last_played_at": stats.last_played_at.isoformat() if stats.last_played_at else None
+                }
+                for stats, below_count, player_count in modes
+            ],
+            "trend": [
+                {
+                    "day": day.day.isoformat(),
+                    "mode": day.mode,
+                    "submode": day.submode,
+                    "games": day.games,
+                    "best_wpm": day.best_wpm,
+                    "average_wpm": round(day.wpm_total / day.games, 2),
+                    "average_accuracy": round(day.accuracy_total / day.games, 2)
+                }
+                for day in trend
+            ]
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 @router.post("/login")
 def login(db: db_dependency, user: UserLogin = Body(...)):
     user_in_db = db.query(User).filter(User.email == user.email).first()
@@ -151,41 +239,45 @@ def login(db: db_dependency, user: UserLogin = Body(...)):
     return {"success": True, "token": token, "user": new_user}
 
 @router.post("/update-stats")
-def update_stats(db: db_dependency, stats: UserStatsUpdate = Body(...), token: str = Depends(oauth2_scheme)):
+async def update_stats(db: async_db_dependency, stats: UserStatsUpdate = Body(...), token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET"), algorithms=["HS256"])
-        user = db.query(User).filter(User.id == payload["sub"]).first()
+        user_id = get_token_subject(token)
+        if not user_id:
+            return {"success": False, "error": "Invalid token"}
+        # Checked here, before the game is queued, so a bad value fails this
+        # request instead of the stats writer's batch (NaN fails the ranges too)
+        if not 0 <= stats.wpm <= MAX_WPM or not 0 <= stats.accuracy <= 100:
+            return {"success": False, "error": "WPM or accuracy out of range"}
+        if stats.mode not in GAME_MODES:
+            return {"success": False, "error": "Mode must be either 'time' or 'words'"}
+        if any(value is not None and not 0 <= value <= MAX_GAME_LENGTH for value in (stats.duration, stats.word_count)):
+            return {"success": False, "error": "Duration or word count out of range"}
+        user = (await db.execute(
+            select(User.id, User.best_wpm, User.best_accuracy, User.total_games, User.average_wpm, User.average_accuracy)
+            .where(User.id == int(user_id))
+        )).first()
         
         if not user:
             return {"success": False, "error": "User not found"}
         
-        # Update best scores
-        if stats.wpm > (user.best_wpm or 0):
-            user.best_wpm = stats.wpm
-        
-        if stats.accuracy > (user.best_accuracy or 0.0):
-            user.best_accuracy = stats.accuracy
-        
-        # Update total games
-        user.total_games = (user.total_games or 0) + 1
-        
-        # Calculate new averages
-        current_total_wpm = (user.average_wpm or 0.0) * ((user.total_games or 1) - 1)
-        user.average_wpm = (current_total_wpm + stats.wpm) / user.total_games
-        
-        current_total_accuracy = (user.average_accuracy or 0.0) * ((user.total_games or 1) - 1)
-        user.average_accuracy = (current_total_accuracy + stats.accuracy) / user.total_games
-        
-        db.commit()
+        # Written to the database in batches by the stats writer; the
+        # response already includes every game still waiting to be written
+        submode = stats.duration if stats.mode == "time" else stats.word_count
+        pending = stats_writer.record(
+            user.id, stats.wpm, stats.accuracy, stats.mode, submode, stats.duration, stats.word_count
+        )
+        updated = pending.apply(
+            user.best_wpm, user.best_accuracy, user.total_games, user.average_wpm, user.average_accuracy
+        )
         
         return {
             "success": True,
             "stats": {
-                "best_wpm": user.best_wpm,
-                "best_accuracy": user.best_accuracy,
-                "total_games": user.total_games,
-                "average_wpm": round(user.average_wpm, 2),
-                "average_accuracy": round(user.average_accuracy, 2)
+                "best_wpm": updated["best_wpm"],
+                "best_accuracy": updated["best_accuracy"],
+                "total_games": updated["total_games"],
+                "average_wpm": round(updated["average_wpm"], 2),
+                "average_accuracy": round(updated["average_accuracy"], 2)
             }
         }
     except Exception as e:
@@ -202,8 +294,9 @@ def forgot_password(db: db_dependency, request: ForgotPasswordRequest = Body(...
     user.reset_code_expires = datetime.utcnow() + get_reset_code_expiry()
     db.commit()
     
-    email_sent = send_reset_code_email(user.email, reset_code)
-    if not email_sent:
+    # Only queued here; the email dispatcher sends it in the background
+    email_queued = from_thread.run_sync(send_reset_code_email, user.email, reset_code)
+    if not email_queued:
         return {"success": False, "error": "Failed to send email"}
     
     return {"success": True, "message": "Reset code sent to your email"}
@@ -244,21 +337,33 @@ def reset_password(db: db_dependency, request: ResetPasswordRequest = Body(...))
     return {"success": True, "message": "Password reset successful"}
 
 @router.get("/leaderboard")
-def get_leaderboard(db: db_dependency, limit: int = 50):
+async def get_leaderboard(db: async_db_dependency, limit: int = 50, offset: int = 0):
     try:
-        # Fetch users sorted by best_wpm descending, then by best_accuracy descending
-        users = db.query(User).filter(
-            User.best_wpm.isnot(None),
-            User.best_wpm > 0
-        ).order_by(
-            User.best_wpm.desc(),
-            User.best_accuracy.desc()
-        ).limit(limit).all()
+        limit = max(0, min(limit, 100))
+        offset = max(0, offset)
+        if await leaderboard.exists():
+            return {
+                "success": True,
+                "leaderboard": await leaderboard.get_page(offset, limit),
+                "total_users": await leaderboard.count()
+            }
+
+        # Board not built yet (e.g. fresh Redis); serve straight from the DB
+        users = (await db.execute(
+            select(User).filter(
+                User.best_wpm.isnot(None),
+                User.best_wpm > 0
+            ).order_by(
+                User.best_wpm.desc(),
+                User.best_accuracy.desc()
+            ).offset(offset).limit(limit)
+        )).scalars().all()
         
         leaderboard_data = []
-        for index, user in enumerate(users, 1):
+        for index, user in enumerate(users, offset + 1):
             leaderboard_data.append({
                 "position": index,
+                "user_id": str(user.id),
                 "username": user.username,
                 "wpm": user.best_wpm or 0,
                 "accuracy": round(user.best_accuracy or 0, 1),
@@ -273,30 +378,61 @@ def get_leaderboard(db: db_dependency, limit: int = 50):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@router.get("/leaderboard/me")
+async def get_my_rank(radius: int = 5, token: str = Depends(oauth2_scheme)):
+    try:
+        user_id = get_token_subject(token)
+        if not user_id:
+            return {"success": False, "error": "Invalid token"}
+        
+        around = await leaderboard.get_around(user_id, max(0, min(radius, 25)))
+        if not around:
+            return {"success": True, "position": None, "neighbours": []}
+        
+        return {"success": True, **around}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 @router.post("/check-username")
-def check_username(db: db_dependency, payload: UsernameCheck = Body(...)):
+async def check_username(db: async_db_dependency, payload: UsernameCheck = Body(...)):
     try:
-        user = db.query(User).filter(User.username.ilike(payload.username)).first()
-        return {"available": user is None}
+        username = normalize_username(payload.username)
+        # Most names asked about were never taken; the filter answers those
+        if await username_filter.might_contain(username) is False:
+            USERNAME_CHECKS.labels("filter").inc()
+            return {"available": True}
+        USERNAME_CHECKS.labels("db").inc()
+        user_id = await db.scalar(select(User.id).where(User.username_lower == username).limit(1))
+        return {"available": user_id is None}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @router.post("/update-username")
 def update_username(db: db_dependency, request: UsernameCheck = Body(...), token: str = Depends(oauth2_scheme)):
     try:
-        user = db.query(User).filter(User.username.ilike(request.username)).first()
+        user = db.query(User).filter(User.username_lower == normalize_username(request.username)).first()
         if user:
             return {"success": False, "error": "Username already exists"}
         
-        payload = jwt.decode(token, os.getenv("JWT_SECRET"), algorithms=["HS256"])
-        user = db.query(User).filter(User.id == payload["sub"]).first()
+        user_id = get_token_subject(token)
+        if not user_id:
+            return {"success": False, "error": "Invalid token"}
+        user = db.query(User).filter(User.id == user_id).first()
         
         if not user:
             return {"success": False, "error": "User not found"}
         
         print("User found:", user)
         user.username = request.username
-        db.commit()
+        try:
+            db.commit()
+        except IntegrityError:
+            # Taken by a concurrent request since the check above
+            db.rollback()
+            return {"success": False, "error": "Username already exists"}
+        from_thread.run(username_filter.add, user.username_lower)
+        invalidate_user(user.id)
+        from_thread.run(leaderboard.rename_user, str(user.id), user.username)
         
         return {"success": True, "message": "Username updated successfully"}
     except Exception as e:
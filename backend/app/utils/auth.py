@@ -0,0 +1,101 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Annotated, Optional
+
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.db import AsyncSessionLocal
+from app.models.sqlalchemy_user import User
+from app.utils.cache import TTLCache
+from app.utils.db_conn import async_db_dependency
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
+
+# Caches are per worker; the TTL bounds how long another worker can serve a
+# stale username after it changes
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+
+_claims_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)    # token -> (user id, exp or None)
+_identity_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)  # user id -> AuthenticatedUser
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: str
+    username: Optional[str]
+
+
+def get_token_subject(token: str) -> Optional[str]:
+    """Return the user id a JWT was issued for, or None if it is invalid"""
+    if not token:
+        return None
+    cached = _claims_cache.get(token)
+    if cached:
+        user_id, expires_at = cached
+        # A cache hit skips jwt.decode, so enforce the token's own expiry here
+        if expires_at is not None and expires_at <= time.time():
+            _claims_cache.delete(token)
+            return None
+        return user_id
+
+    secret = os.getenv("JWT_SECRET")
+    if not secret:
+        return None
+    try:
+        payload = jwt.decode(token, secret, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        return None
+    user_id = payload.get("sub")
+    if not user_id:
+        return None
+    user_id = str(user_id)
+    expires_at = payload.get("exp")
+    _claims_cache.set(token, (user_id, float(expires_at) if expires_at is not None else None))
+    return user_id
+
+
+async def resolve_token(token: str, db: Optional[AsyncSession] = None) -> Optional[AuthenticatedUser]:
+    """Resolve a JWT to the user's id and username, hitting the DB only on a cache miss"""
+    user_id = get_token_subject(token)
+    if not user_id:
+        return None
+    user = _identity_cache.get(user_id)
+    if user:
+        return user
+
+    try:
+        lookup_id = int(user_id)
+    except ValueError:
+        return None
+    query = select(User.id, User.username).where(User.id == lookup_id)
+    if db is None:
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(query)).first()
+    else:
+        row = (await db.execute(query)).first()
+    if not row:
+        return None
+    user = AuthenticatedUser(id=str(row.id), username=row.username)
+    _identity_cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id) -> None:
+    """Drop a user's cached identity, e.g. after a username change"""
+    _identity_cache.delete(str(user_id))
+
+
+async def get_current_user(db: async_db_dependency, token: str = Depends(oauth2_scheme)) -> AuthenticatedUser:
+    user = await resolve_token(token, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user
+
+
+current_user_dependency = Annotated[AuthenticatedUser, Depends(get_current_user)]
@@ -0,0 +1,54 @@
+"""JSON codec shared by the Redis layer and the WebSocket endpoint.
+
+The fastest installed backend is picked at import: orjson when available,
+otherwise the standard library. Either way ``dumps`` returns UTF-8 bytes
+(Redis takes them as-is) and datetime, date and UUID values are encoded as
+ISO-8601 / hex-with-dashes strings.
+"""
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def _default(obj: Any):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize ``obj`` to JSON as UTF-8 bytes"""
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    """Serialize ``obj`` to JSON as UTF-8 bytes"""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    dumps = _orjson_dumps
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+    dumps = _json_dumps
+    loads = json.loads
+
+
+def dumps_str(obj: Any) -> str:
+    """Serialize ``obj`` to a JSON string, for APIs that only take text"""
+    return dumps(obj).decode("utf-8")
+
+
+def decode(data: Union[bytes, str, None]) -> Any:
+    """Load a JSON value read back from Redis, passing ``None`` through"""
+    return loads(data) if data is not None else None
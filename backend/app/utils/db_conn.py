@@ -1,5 +1,6 @@
-from app.config.db import SessionLocal
+from app.config.db import SessionLocal, AsyncSessionLocal
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 from typing import Annotated
 
@@ -11,3 +12,9 @@ def get_db():
         db.close()
 
 db_dependency = Annotated[Session, Depends(get_db)]
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async_db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
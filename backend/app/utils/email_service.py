@@ -1,61 +1,82 @@
-import smtplib
+"""Outbound email, sent in the background over reused SMTP connections.
+
+Routes call ``email_dispatcher.submit`` and return straight away. The email
+waits in a bounded queue (``EMAIL_QUEUE_SIZE``). ``EMAIL_WORKERS`` tasks
+each keep one SMTP connection open, so STARTTLS and login are paid once per
+connection and not once per email. A failed send is retried with
+exponential backoff, up to ``EMAIL_MAX_ATTEMPTS`` attempts. Templates are
+prepared once, when the dispatcher starts.
+
+To try it against a local SMTP sink instead of a real server:
+
+    python -m aiosmtpd -n -l localhost:1025
+    SMTP_SERVER=localhost SMTP_PORT=1025 SMTP_STARTTLS=0 SENDER_EMAIL=noreply@localhost
+
+Login is skipped when SENDER_PASSWORD is not set.
+"""
+import asyncio
+import os
 import random
+import smtplib
+import ssl
 import string
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
-import os
-from dotenv import load_dotenv
+import textwrap
+import time
+from datetime import timedelta
+from email.message import EmailMessage
+from string import Template
+from typing import Dict, Optional
 
-load_dotenv()
+from app.utils import metrics
 
-def generate_reset_code():
-    """Generate a 6-digit numeric code"""
-    return ''.join(random.choices(string.digits, k=6))
+EMAILS = metrics.Counter("rapidkeys_emails_total", "Outbound emails by result", ["result"])
+EMAIL_QUEUE_DEPTH = metrics.Gauge(
+    "rapidkeys_email_queue_depth", "Emails waiting to be sent on this worker",
+    function=lambda: email_dispatcher.queued
+)
+
+# name: (subject, plain text, html); $code and friends are filled in per email
+TEMPLATES = {
+    "reset_code": (
+        "RapidKeys - Password Reset Code",
+        """
+        RapidKeys - Password Reset Code
+
+        We received a request to reset your password.
+
+        Your verification code is: $code
 
-def send_reset_code_email(email: str, reset_code: str):
-    """Send password reset code via email"""
-    try:
-        # Email configuration
-        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.getenv("SMTP_PORT", "587"))
-        sender_email = os.getenv("SENDER_EMAIL")
-        sender_password = os.getenv("SENDER_PASSWORD")
-        
-        if not sender_email or not sender_password:
-            raise Exception("Email configuration not found in environment variables")
-        
-        # Create message
-        message = MIMEMultipart("alternative")
-        message["Subject"] = "RapidKeys - Password Reset Code"
-        message["From"] = sender_email
-        message["To"] = email
-        
-        # Email content
-        html = f"""
+        This code will expire in 15 minutes.
+
+        If you didn't request this password reset, please ignore this email.
+
+        Best regards,
+        The RapidKeys Team
+        """,
+        """
         <html>
           <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
             <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; border-radius: 10px; text-align: center;">
               <h1 style="color: white; margin: 0; font-size: 28px;">RapidKeys</h1>
               <p style="color: white; margin: 10px 0 0 0; opacity: 0.9;">Password Reset Request</p>
             </div>
-            
+
             <div style="padding: 30px; background: #f8f9fa; border-radius: 0 0 10px 10px;">
               <h2 style="color: #333; margin-bottom: 20px;">Reset Your Password</h2>
               <p style="color: #666; line-height: 1.6; margin-bottom: 25px;">
                 We received a request to reset your password. Use the verification code below to proceed:
               </p>
-              
+
               <div style="background: white; border: 2px solid #667eea; border-radius: 8px; padding: 20px; text-align: center; margin: 25px 0;">
                 <h1 style="color: #667eea; font-size: 36px; margin: 0; letter-spacing: 8px; font-family: 'Courier New', monospace;">
-                  {reset_code}
+                  $code
                 </h1>
               </div>
-              
+
               <p style="color: #666; line-height: 1.6; margin-bottom: 20px;">
                 This code will expire in <strong>15 minutes</strong>. If you didn't request this password reset, please ignore this email.
               </p>
-              
+
               <div style="border-top: 1px solid #ddd; padding-top: 20px; margin-top: 30px;">
                 <p style="color: #999; font-size: 14px; margin: 0;">
                   Best regards,<br>
@@ -65,41 +86,188 @@ def send_reset_code_email(email: str, reset_code: str):
             </div>
           </body>
         </html>
+        """,
+    ),
+}
+
+
+class EmailTemplate:
+    """A template with its static text prepared once"""
+
+    def __init__(self, subject: str, text: str, html: str):
+        self.subject = subject
+        self.text = Template(textwrap.dedent(text).strip() + "\n")
+        self.html = Template(textwrap.dedent(html).strip() + "\n")
+
+    def render(self, sender: str, to: str, values: Dict[str, str]) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = self.subject
+        message["From"] = sender
+        message["To"] = to
+        message.set_content(self.text.substitute(values))
+        message.add_alternative(self.html.substitute(values), subtype="html")
+        return message
+
+
+class SmtpSession:
+    """One SMTP connection, opened on first send and reused afterwards.
+
+    Blocking; the dispatcher calls it from a worker thread, one send at a
+    time. A connection idle for longer than ``SMTP_KEEPALIVE`` seconds is
+    replaced rather than trusted, since servers drop idle clients.
+    """
+
+    def __init__(self):
+        self.host = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+        self.port = int(os.getenv("SMTP_PORT", "587"))
+        self.starttls = os.getenv("SMTP_STARTTLS", "1") == "1"
+        self.timeout = float(os.getenv("SMTP_TIMEOUT", 10))
+        self.keepalive = float(os.getenv("SMTP_KEEPALIVE", 60))
+        self.username = os.getenv("SENDER_EMAIL")
+        self.password = os.getenv("SENDER_PASSWORD")
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def send(self, message: EmailMessage):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.keepalive:
+            self.close()
+        if self._smtp is None:
+            self._connect()
+        try:
+            self._smtp.send_message(message)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server answered, so the connection is still usable
+            raise
+        except OSError:
+            # Dropped or broken connection (SMTPException is an OSError too);
+            # the next attempt reconnects
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx replies and refused recipients will not succeed on a retry"""
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class EmailDispatcher:
+    """Bounded queue of outbound emails drained by background workers"""
+
+    def __init__(self):
+        self.queue_size = int(os.getenv("EMAIL_QUEUE_SIZE", 1000))
+        self.workers = int(os.getenv("EMAIL_WORKERS", 2))
+        self.max_attempts = int(os.getenv("EMAIL_MAX_ATTEMPTS", 5))
+        self.retry_backoff = float(os.getenv("EMAIL_RETRY_BACKOFF", 1.0))
+        self.drain_timeout = float(os.getenv("EMAIL_DRAIN_TIMEOUT", 10))
+        self.sender = None
+        self._templates: Dict[str, EmailTemplate] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self.sender = os.getenv("SENDER_EMAIL")
+        self._templates = {name: EmailTemplate(*parts) for name, parts in TEMPLATES.items()}
+        # Created here so it belongs to the running event loop
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._run(SmtpSession())) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Send what is already queued (for up to ``EMAIL_DRAIN_TIMEOUT``), then close the connections"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Email dispatcher: {self._queue.qsize()} emails not sent on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, to: str, template: str, values: Dict[str, str]) -> bool:
+        """Queue an email; False if email is not configured or the queue is full.
+
+        Must be called on the event loop (use anyio's from_thread in sync routes).
         """
-        
-        text = f"""
-        RapidKeys - Password Reset Code
-        
-        We received a request to reset your password.
-        
-        Your verification code is: {reset_code}
-        
-        This code will expire in 15 minutes.
-        
-        If you didn't request this password reset, please ignore this email.
-        
-        Best regards,
-        The RapidKeys Team
-        """
-        
-        # Create text and HTML parts
-        part1 = MIMEText(text, "plain")
-        part2 = MIMEText(html, "html")
-        
-        message.attach(part1)
-        message.attach(part2)
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, email, message.as_string())
-        
+        if self._queue is None or not self.sender:
+            return False
+        message = self._templates[template].render(self.sender, to, values)
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            EMAILS.labels("rejected").inc()
+            return False
         return True
-        
-    except Exception as e:
-        print(f"Error sending email: {str(e)}")
-        return False
+
+    async def _run(self, session: SmtpSession):
+        try:
+            while True:
+                message = await self._queue.get()
+                try:
+                    await self._deliver(session, message)
+                finally:
+                    self._queue.task_done()
+        finally:
+            await asyncio.to_thread(session.close)
+
+    async def _deliver(self, session: SmtpSession, message: EmailMessage):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await asyncio.to_thread(session.send, message)
+                EMAILS.labels("sent").inc()
+                return
+            except Exception as e:
+                if _is_permanent(e) or attempt == self.max_attempts:
+                    EMAILS.labels("failed").inc()
+                    print(f"Error sending email to {message['To']} (attempt {attempt}): {e}")
+                    return
+                EMAILS.labels("retried").inc()
+                # Exponential backoff with jitter so workers do not retry in step
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+
+email_dispatcher = EmailDispatcher()
+
+
+def generate_reset_code():
+    """Generate a 6-digit numeric code"""
+    return ''.join(random.choices(string.digits, k=6))
+
+def send_reset_code_email(email: str, reset_code: str) -> bool:
+    """Queue the password reset code email; call on the event loop"""
+    return email_dispatcher.submit(email, "reset_code", {"code": reset_code})
 
 def get_reset_code_expiry():
     """Get expiry time for reset code (15 minutes from now)"""
@@ -0,0 +1,43 @@
+"""Shared outbound HTTP client.
+
+One pooled ``httpx.AsyncClient`` per worker, opened by the app lifespan and
+closed on shutdown, so calls to the same host reuse kept-alive TLS
+connections instead of handshaking every time.
+"""
+import os
+from typing import Optional
+
+import httpx
+
+
+class HttpClient:
+    def __init__(self):
+        self.timeout = httpx.Timeout(
+            float(os.getenv("HTTP_TIMEOUT", 10)),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+        )
+        self.limits = httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled client; created here too if used outside the app lifespan"""
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+    async def stop(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+
+http_client = HttpClient()
@@ -0,0 +1,210 @@
+"""Global leaderboard kept in a Redis sorted set.
+
+Users are ranked by best WPM with best accuracy breaking ties, packed into a
+single score. Display fields (username, wpm, accuracy, total games) live in a
+companion hash so a page of the board costs one pipelined round trip.
+
+The board only counts as built once a full rebuild has set the
+``leaderboard:built`` marker; until then submissions are not written to it
+(a board holding only recent scores would look complete) and reads go to
+the database. It is built in the background at startup when missing, or by
+hand with:
+
+    python -m app.utils.leaderboard
+"""
+import asyncio
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.config.db import SessionLocal
+from app.config.redis_config import redis_manager
+from app.models.sqlalchemy_user import User
+from app.utils import codec
+
+LEADERBOARD_KEY = "leaderboard"
+LEADERBOARD_USERS_KEY = "leaderboard:users"
+LEADERBOARD_BUILT_KEY = "leaderboard:built"
+# Set while a rebuild is filling the temporary keys
+LEADERBOARD_REBUILDING_KEY = "leaderboard:rebuilding"
+
+# Accuracy is kept to two decimals (0..10000) and must never carry into WPM
+ACCURACY_SCALE = 100
+WPM_SCALE = 100 * ACCURACY_SCALE + 1
+
+# KEYS: board, users, built marker, rebuild board, rebuild users, rebuilding marker
+# ARGV: user id, score, entry. Scores only move up; a board that has not been
+# built is left alone, and a rebuild in progress gets the score as well so
+# it cannot be lost to the swap
+SUBMIT_SCRIPT = """
+local written = 0
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('ZADD', KEYS[1], 'GT', ARGV[2], ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+    written = 1
+end
+if redis.call('EXISTS', KEYS[6]) == 1 then
+    redis.call('ZADD', KEYS[4], 'GT', ARGV[2], ARGV[1])
+    redis.call('HSET', KEYS[5], ARGV[1], ARGV[3])
+    written = 1
+end
+return written
+"""
+
+
+def leaderboard_score(wpm: int, accuracy: float) -> int:
+    """Pack best WPM and best accuracy into one sortable score"""
+    return int(wpm or 0) * WPM_SCALE + round((accuracy or 0.0) * ACCURACY_SCALE)
+
+
+def _user_entry(username: Optional[str], wpm: int, accuracy: float, total_games: int) -> bytes:
+    return codec.dumps({
+        "username": username,
+        "wpm": wpm or 0,
+        "accuracy": round(accuracy or 0, 1),
+        "total_games": total_games or 0
+    })
+
+
+class Leaderboard:
+    def __init__(self, redis_manager):
+        self.redis_manager = redis_manager
+        self.build_lock_ttl = int(os.getenv("LEADERBOARD_BUILD_LOCK_TTL", 300))
+        self._submit_script = None
+
+    @property
+    def redis_client(self):
+        return self.redis_manager.redis_client
+
+    async def exists(self) -> bool:
+        """Whether a full build has finished; until then the DB is the leaderboard"""
+        return await self.redis_client.exists(LEADERBOARD_BUILT_KEY) > 0
+
+    async def submit(self, user_id: str, username: Optional[str], best_wpm: int, best_accuracy: float, total_games: int):
+        """Record a user's current bests; the score only ever moves up"""
+        if not best_wpm:
+            return
+        if self._submit_script is None:
+            self._submit_script = self.redis_client.register_script(SUBMIT_SCRIPT)
+        await self._submit_script(
+            keys=[LEADERBOARD_KEY, LEADERBOARD_USERS_KEY, LEADERBOARD_BUILT_KEY,
+                  f"{LEADERBOARD_KEY}:rebuild", f"{LEADERBOARD_USERS_KEY}:rebuild", LEADERBOARD_REBUILDING_KEY],
+            args=[str(user_id), leaderboard_score(best_wpm, best_accuracy),
+                  _user_entry(username, best_wpm, best_accuracy, total_games)],
+            client=self.redis_client
+        )
+
+    async def rename_user(self, user_id: str, username: str):
+        """Keep the display name in sync after a username change"""
+        entry = await self.redis_client.hget(LEADERBOARD_USERS_KEY, str(user_id))
+        if entry:
+            data = codec.loads(entry)
+            data["username"] = username
+            await self.redis_client.hset(LEADERBOARD_USERS_KEY, str(user_id), codec.dumps(data))
+
+    async def get_page(self, offset: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """Return ``limit`` entries starting at rank ``offset`` (0-based)"""
+        if limit <= 0:
+            return []
+        user_ids = await self.redis_client.zrevrange(LEADERBOARD_KEY, offset, offset + limit - 1)
+        return await self._entries(user_ids, offset)
+
+    async def get_around(self, user_id: str, radius: int = 5) -> Optional[Dict[str, Any]]:
+        """Return a user's 1-based position plus up to ``radius`` neighbours either side"""
+        rank = await self.redis_client.zrevrank(LEADERBOARD_KEY, str(user_id))
+        if rank is None:
+            return None
+        start = max(0, rank - radius)
+        user_ids = await self.redis_client.zrevrange(LEADERBOARD_KEY, start, rank + radius)
+        return {
+            "position": rank + 1,
+            "neighbours": await self._entries(user_ids, start)
+        }
+
+    async def count(self) -> int:
+        return await self.redis_client.zcard(LEADERBOARD_KEY)
+
+    async def _entries(self, user_ids: List[str], offset: int) -> List[Dict[str, Any]]:
+        if not user_ids:
+            return []
+        entries = await self.redis_client.hmget(LEADERBOARD_USERS_KEY, user_ids)
+        board = []
+        for index, (user_id, entry) in enumerate(zip(user_ids, entries), offset + 1):
+            data = codec.loads(entry) if entry else {"username": None, "wpm": 0, "accuracy": 0, "total_games": 0}
+            board.append({"position": index, "user_id": user_id, **data})
+        return board
+
+    async def rebuild(self, load_users: Callable[[], Iterable[tuple]], batch_size: int = 1000) -> int:
+        """Rebuild the board from ``(id, username, best_wpm, best_accuracy, total_games)`` rows.
+
+        The new board is written under temporary keys and swapped in with
+        RENAME, so readers never see a half-built leaderboard. Scores
+        submitted from just before ``load_users`` runs (in a thread) until
+        the swap are written to the temporary keys too, so none are lost.
+        """
+        tmp_key = f"{LEADERBOARD_KEY}:rebuild"
+        tmp_users_key = f"{LEADERBOARD_USERS_KEY}:rebuild"
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(tmp_key, tmp_users_key)
+        pipe.set(LEADERBOARD_REBUILDING_KEY, 1, ex=self.build_lock_ttl)
+        await pipe.execute()
+        users = await asyncio.to_thread(load_users)
+
+        count = 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id, username, best_wpm, best_accuracy, total_games in users:
+            if not best_wpm:
+                continue
+            # A user submitted during the rebuild already has their latest
+            # stats in place, which this row may predate
+            pipe.zadd(tmp_key, {str(user_id): leaderboard_score(best_wpm, best_accuracy)}, gt=True)
+            pipe.hsetnx(tmp_users_key, str(user_id), _user_entry(username, best_wpm, best_accuracy, total_games))
+            count += 1
+            if count % batch_size == 0:
+                await pipe.execute()
+        await pipe.execute()
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(LEADERBOARD_KEY, LEADERBOARD_USERS_KEY, LEADERBOARD_REBUILDING_KEY)
+        # RENAME of a missing key is an error, so the swap happens in Lua
+        # only for keys that exist (an empty board has none)
+        pipe.eval(
+            "for i = 1, #KEYS, 2 do if redis.call('EXISTS', KEYS[i]) == 1 then "
+            "redis.call('RENAME', KEYS[i], KEYS[i + 1]) end end",
+            4, tmp_key, LEADERBOARD_KEY, tmp_users_key, LEADERBOARD_USERS_KEY
+        )
+        pipe.set(LEADERBOARD_BUILT_KEY, 1)
+        await pipe.execute()
+        return count
+
+    async def ensure_built(self):
+        """Build the board if no worker has yet; run in the background at startup"""
+        try:
+            if await self.exists():
+                return
+            lock_key = f"{LEADERBOARD_KEY}:building"
+            if not await self.redis_client.set(lock_key, 1, nx=True, ex=self.build_lock_ttl):
+                return  # Another worker is on it
+            try:
+                print(f"Leaderboard built with {await rebuild_from_db()} users")
+            finally:
+                await self.redis_client.delete(lock_key)
+        except Exception as e:
+            print(f"Error building leaderboard: {e}")
+
+
+leaderboard = Leaderboard(redis_manager)
+
+
+def _rows_from_db():
+    with SessionLocal() as db:
+        return db.query(
+            User.id, User.username, User.best_wpm, User.best_accuracy, User.total_games
+        ).filter(User.best_wpm > 0).all()
+
+
+async def rebuild_from_db() -> int:
+    return await leaderboard.rebuild(_rows_from_db)
+
+
+if __name__ == "__main__":
+    print(f"Rebuilt leaderboard with {asyncio.run(rebuild_from_db())} users")
@@ -0,0 +1,206 @@
+"""Handler timing hooks, slow-op log and an on-demand sampling profiler.
+
+Each WebSocket message (and each progress flush, join and leave) runs
+inside ``track``, which times the whole operation. Code inside it marks its
+Redis, serialization and send work with ``phase``. The split goes to the
+``rapidkeys_handler_seconds`` histogram. Operations slower than
+``SLOW_OP_MS`` are also printed as one JSON line with the room code and
+fan-out size. ``HANDLER_TIMING=0`` turns the hooks into no-ops.
+
+The sampling profiler is off until toggled at runtime with SIGUSR2 (or
+``profiler.toggle()``). While on, it samples the event loop thread's stack
+every ``PROFILER_INTERVAL_MS``. Toggling it off writes the samples in the
+collapsed-stack format (``frame;frame;frame count``) that flamegraph.pl
+and speedscope read, to ``PROFILER_DIR``.
+"""
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from app.utils import codec, metrics
+
+HANDLER_TIMING = os.getenv("HANDLER_TIMING", "1") == "1"
+SLOW_OP_MS = float(os.getenv("SLOW_OP_MS", 100))
+PHASES = ("redis", "serialize", "send")
+
+HANDLER_SECONDS = metrics.Histogram(
+    "rapidkeys_handler_seconds", "Multiplayer handler time by message type and phase", ["type", "phase"]
+)
+
+_current_op: ContextVar[Optional["OpTimer"]] = ContextVar("current_op", default=None)
+_NULL = nullcontext()
+
+
+class OpTimer:
+    """Time spent in one operation, split by phase"""
+
+    def __init__(self, op_type: str, room_code: Optional[str], start: Optional[float] = None):
+        self.op_type = op_type
+        self.room_code = room_code
+        self.fanout = 0
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self._active = set()
+        self.start = start if start is not None else time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        # Nested phases of the same kind (a RedisManager method calling
+        # another) are only counted once
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+            self._active.discard(name)
+
+    def finish(self):
+        total = time.perf_counter() - self.start
+        HANDLER_SECONDS.labels(self.op_type, "total").observe(total)
+        for name, seconds in self.phases.items():
+            if seconds:
+                HANDLER_SECONDS.labels(self.op_type, name).observe(seconds)
+        if total * 1000 >= SLOW_OP_MS:
+            print(codec.dumps_str({
+                "event": "slow_op",
+                "type": self.op_type,
+                "room_code": self.room_code,
+                "fanout": self.fanout,
+                "total_ms": round(total * 1000, 2),
+                **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+                "other_ms": round((total - sum(self.phases.values())) * 1000, 2),
+            }))
+
+
+@contextmanager
+def _track(op_type: str, room_code: Optional[str], start: Optional[float]):
+    op = OpTimer(op_type, room_code, start)
+    token = _current_op.set(op)
+    try:
+        yield op
+    finally:
+        _current_op.reset(token)
+        op.finish()
+
+
+def track(op_type: str, room_code: Optional[str] = None, start: Optional[float] = None):
+    """Time an operation (from ``start`` if given); phases and fan-out inside it are attributed to it"""
+    if not HANDLER_TIMING:
+        return _NULL
+    return _track(op_type, room_code, start)
+
+
+def phase(name: str):
+    """Attribute the enclosed work to a phase of the current operation"""
+    op = _current_op.get()
+    if op is None:
+        return _NULL
+    return op.phase(name)
+
+
+def record_phase(name: str, seconds: float):
+    """Attribute already-measured time to a phase of the current operation"""
+    op = _current_op.get()
+    if op is not None:
+        op.phases[name] += seconds
+
+
+def add_fanout(sockets: int):
+    """Count sockets a frame was sent to in the current operation"""
+    op = _current_op.get()
+    if op is not None:
+        op.fanout += sockets
+
+
+def timed_phase(name: str):
+    """Decorate a coroutine function so its time counts towards ``name``"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """Sample one thread's Python stack from a background thread"""
+
+    def __init__(self):
+        self.interval = float(os.getenv("PROFILER_INTERVAL_MS", 5)) / 1000
+        self.output_dir = os.getenv("PROFILER_DIR", ".")
+        self._stacks = StackCounter()
+        self._target_thread = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._sampler is not None
+
+    def start(self, thread_id: Optional[int] = None):
+        """Start sampling ``thread_id`` (by default the calling thread)"""
+        if self.running:
+            return
+        self._stacks.clear()
+        self._target_thread = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler.start()
+        print(f"Sampling profiler started (every {self.interval * 1000:g}ms)")
+
+    def stop(self) -> Optional[str]:
+        """Stop sampling and write the collapsed stacks; returns the file path"""
+        if not self.running:
+            return None
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+
+        path = os.path.join(self.output_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+        with open(path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Sampling profiler wrote {sum(self._stacks.values())} samples to {path}")
+        return path
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def install_signal_handler(self, loop, signum: int = getattr(signal, "SIGUSR2", 0)):
+        """Toggle the profiler for the loop's thread when ``signum`` arrives"""
+        if not signum:
+            return  # no SIGUSR2 on this platform
+        try:
+            loop.add_signal_handler(signum, self.toggle)
+        except (RuntimeError, ValueError) as e:
+            # Signal handlers can only be set from the main thread
+            print(f"Sampling profiler signal handler not installed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
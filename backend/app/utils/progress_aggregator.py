@@ -0,0 +1,64 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Any
+
+# Flush callback receives the room code and the latest progress per user id
+FlushCallback = Callable[[str, Dict[str, Dict[str, Any]]], Awaitable[None]]
+
+
+class ProgressAggregator:
+    """Coalesce typing progress per room and flush it on a fixed tick.
+
+    Racers can report progress as often as they like; only the latest report
+    per user survives until the next tick, when the whole room is flushed in
+    one batch. A room's ticker stops itself once a tick finds nothing pending
+    and is restarted by the next report.
+    """
+
+    def __init__(self, flush: FlushCallback, rate_hz: float = 15):
+        self._flush = flush
+        self.interval = 1 / rate_hz
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def record(self, room_code: str, user_id: str, progress: Dict[str, Any]):
+        """Store the latest progress for a user and make sure the room is ticking"""
+        self._pending.setdefault(room_code, {})[user_id] = progress
+        if room_code not in self._tasks:
+            self._tasks[room_code] = asyncio.create_task(self._run(room_code))
+
+    async def flush_room(self, room_code: str):
+        """Flush a room's pending progress right away"""
+        batch = self._pending.pop(room_code, None)
+        if batch:
+            await self._flush(room_code, batch)
+
+    def discard(self, room_code: str):
+        """Drop pending progress and stop ticking for a room"""
+        self._pending.pop(room_code, None)
+        task = self._tasks.pop(room_code, None)
+        if task:
+            task.cancel()
+
+    async def close(self):
+        """Stop all room tickers"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, room_code: str):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                batch = self._pending.pop(room_code, None)
+                if not batch:
+                    return
+                try:
+                    await self._flush(room_code, batch)
+                except Exception as e:
+                    print(f"Failed to flush progress for room {room_code}: {e}")
+        finally:
+            if self._tasks.get(room_code) is asyncio.current_task():
+                del self._tasks[room_code]
@@ -0,0 +1,94 @@
+import asyncio
+import uuid
+from typing import Awaitable, Callable, Set
+
+# Deliver callback receives the room code, an already-serialized frame and its message type
+DeliverCallback = Callable[[str, str, str], Awaitable[None]]
+
+
+class RoomPubSub:
+    """Fan room frames out across workers over Redis pub/sub.
+
+    Every worker publishes the frames it broadcasts to ``room_channel:{code}``
+    and subscribes only to the rooms it currently holds sockets for. Frames are
+    delivered to local sockets straight away by the publisher, so each message
+    is tagged with the worker id and a worker skips its own frames. The
+    message type travels in the header too, so receivers can route and count
+    a frame without parsing it.
+    """
+
+    CHANNEL_PREFIX = "room_channel:"
+
+    def __init__(self, redis_manager, deliver: DeliverCallback):
+        self.redis_manager = redis_manager
+        self._deliver = deliver
+        self.worker_id = uuid.uuid4().hex
+        self._origin = f"{self.worker_id}\n".encode()
+        self._rooms: Set[str] = set()
+        self._pubsub = None
+        self._listener = None
+        self._lock = asyncio.Lock()
+
+    def _channel(self, room_code: str) -> str:
+        return f"{self.CHANNEL_PREFIX}{room_code}"
+
+    async def publish(self, room_code: str, payload: bytes, message_type: str):
+        """Publish an already-serialized frame to the other workers"""
+        await self.redis_manager.redis_client.publish(
+            self._channel(room_code), self._origin + message_type.encode() + b"\n" + payload
+        )
+
+    async def subscribe(self, room_code: str):
+        """Start receiving a room's frames on this worker"""
+        self._rooms.add(room_code)
+        async with self._lock:
+            if room_code not in self._rooms:
+                return
+            if self._pubsub is None:
+                self._pubsub = self.redis_manager.redis_client.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(self._channel(room_code))
+            if self._listener is None:
+                self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, room_code: str):
+        """Stop receiving a room's frames on this worker"""
+        self._rooms.discard(room_code)
+        async with self._lock:
+            # The room may have picked up a new local socket in the meantime
+            if room_code in self._rooms or self._pubsub is None:
+                return
+            await self._pubsub.unsubscribe(self._channel(room_code))
+
+    async def close(self):
+        """Stop listening and release the pub/sub connection"""
+        self._rooms.clear()
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Room pub/sub listener error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+
+            origin, _, frame = message["data"].partition("\n")
+            if origin == self.worker_id:
+                continue
+            message_type, _, payload = frame.partition("\n")
+            room_code = message["channel"][len(self.CHANNEL_PREFIX):]
+            try:
+                await self._deliver(room_code, payload, message_type)
+            except Exception as e:
+                print(f"Failed to deliver frame for room {room_code}: {e}")
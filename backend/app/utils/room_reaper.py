@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Dict
+
+# KEYS: lock; ARGV: owner token, ttl ms. Extends the lock only for its owner
+EXTEND_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RoomReaper:
+    """Periodically reclaim idle rooms and dangling user/connection keys.
+
+    Every worker runs the timer, but a sweep only happens on the worker that
+    wins a short-lived Redis lock, so at most one sweep runs at a time. The
+    owner keeps extending the lock while it sweeps, so a slow sweep cannot
+    outlive it and overlap the next one.
+    """
+
+    LOCK_KEY = "reaper:lock"
+
+    def __init__(self, redis_manager):
+        self.redis_manager = redis_manager
+        self.interval = float(os.getenv("ROOM_REAPER_INTERVAL", 60))
+        self.idle_timeout = float(os.getenv("ROOM_IDLE_TIMEOUT", 1800))
+        self.finished_timeout = float(os.getenv("ROOM_FINISHED_TIMEOUT", 600))
+        self.batch_size = int(os.getenv("ROOM_REAPER_BATCH_SIZE", 100))
+        self.worker_id = uuid.uuid4().hex
+        self.stats: Dict[str, Any] = {
+            "sweeps": 0,
+            "sweeps_skipped": 0,
+            "sweep_errors": 0,
+            "rooms_reaped": 0,
+            "index_entries_removed": 0,
+            "user_keys_removed": 0,
+            "connection_keys_removed": 0,
+            "last_sweep_seconds": 0.0,
+        }
+        self._task = None
+        self._extend_script = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def sweep(self) -> bool:
+        """Run one sweep if this worker can take the lock; returns whether it ran"""
+        # The lock outlives a normal sweep but expires before the next tick
+        lock_ttl = max(1, int(self.interval * 0.9))
+        acquired = await self.redis_manager.redis_client.set(
+            self.LOCK_KEY, self.worker_id, nx=True, ex=lock_ttl
+        )
+        if not acquired:
+            self.stats["sweeps_skipped"] += 1
+            return False
+
+        start = time.perf_counter()
+        keeper = asyncio.create_task(self._hold_lock(lock_ttl))
+        try:
+            result = await self.redis_manager.cleanup_expired_rooms(
+                self.idle_timeout, self.finished_timeout, self.batch_size
+            )
+        finally:
+            keeper.cancel()
+        duration = time.perf_counter() - start
+
+        self.stats["sweeps"] += 1
+        self.stats["last_sweep_seconds"] = duration
+        for name, count in result.items():
+            self.stats[name] += count
+        print(
+            f"Room reaper: reaped {result['rooms_reaped']} rooms, removed {result['index_entries_removed']} "
+            f"stale index entries, {result['user_keys_removed']} user keys and "
+            f"{result['connection_keys_removed']} connection keys in {duration * 1000:.1f}ms"
+        )
+        return True
+
+    async def _hold_lock(self, lock_ttl: int):
+        """Push the lock's expiry back every third of its TTL while this worker still owns it"""
+        redis_client = self.redis_manager.redis_client
+        if self._extend_script is None:
+            self._extend_script = redis_client.register_script(EXTEND_LOCK)
+        while True:
+            await asyncio.sleep(lock_ttl / 3)
+            try:
+                extended = await self._extend_script(
+                    keys=[self.LOCK_KEY], args=[self.worker_id, lock_ttl * 1000], client=redis_client
+                )
+            except Exception as e:
+                print(f"Room reaper could not extend its lock: {e}")
+                continue
+            if not extended:
+                print("Room reaper lost its lock mid-sweep")
+                return
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.stats["sweep_errors"] += 1
+                print(f"Room reaper sweep failed: {e}")
@@ -0,0 +1,340 @@
+import asyncio
+import importlib
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, case, func, insert, select, update
+from sqlalchemy import exc as sa_exc
+
+from app.config.db import database
+from app.models.sqlalchemy_game_result import GameResult, UserDailyStats, UserModeStats
+from app.models.sqlalchemy_user import User
+from app.utils import codec, metrics
+from app.utils.leaderboard import leaderboard
+
+STATS_DEAD_LETTERS = metrics.Counter(
+    "rapidkeys_stats_dead_letter_total", "Users whose queued games were dropped after repeated write failures"
+)
+STATS_REJECTED = metrics.Counter(
+    "rapidkeys_stats_rejected_total", "Finished games refused because the stats queue was full"
+)
+
+
+class StatsBacklogFull(Exception):
+    """The write-behind queue is at its bound; the game was not recorded"""
+
+
+def _is_transient(error: Exception) -> bool:
+    """Errors that say the database could not be reached, not that the data is bad"""
+    return isinstance(error, (
+        sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError,
+        OSError, asyncio.TimeoutError
+    ))
+
+
+# Rollups are upserted with ON CONFLICT, which both dialects spell the same way
+_UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def _dialect_insert(dialect_name: str):
+    # Imported on first flush so startup does not load both dialects
+    if dialect_name not in _UPSERT_DIALECTS:
+        raise ValueError(f"Rollup upserts are not supported on {dialect_name}")
+    return importlib.import_module(f"sqlalchemy.dialects.{dialect_name}").insert
+
+
+@dataclass
+class PendingStats:
+    """Finished games for one user that have not been written yet"""
+    games: int = 0
+    wpm_total: float = 0
+    accuracy_total: float = 0.0
+    best_wpm: int = 0
+    best_accuracy: float = 0.0
+
+    def add(self, wpm: int, accuracy: float):
+        self.games += 1
+        self.wpm_total += wpm
+        self.accuracy_total += accuracy
+        self.best_wpm = max(self.best_wpm, wpm)
+        self.best_accuracy = max(self.best_accuracy, accuracy)
+
+    def merge(self, other: "PendingStats"):
+        self.games += other.games
+        self.wpm_total += other.wpm_total
+        self.accuracy_total += other.accuracy_total
+        self.best_wpm = max(self.best_wpm, other.best_wpm)
+        self.best_accuracy = max(self.best_accuracy, other.best_accuracy)
+
+    def apply(self, best_wpm, best_accuracy, total_games, average_wpm, average_accuracy) -> Dict[str, Any]:
+        """The stats a user ends up with once these games are applied.
+
+        Folding n games into a running average at once gives the same result
+        as adding them one by one: (average * total + sum) / (total + n).
+        """
+        previous_games = total_games or 0
+        games = previous_games + self.games
+        return {
+            "best_wpm": max(best_wpm or 0, self.best_wpm),
+            "best_accuracy": max(best_accuracy or 0.0, self.best_accuracy),
+            "total_games": games,
+            "average_wpm": ((average_wpm or 0.0) * previous_games + self.wpm_total) / games,
+            "average_accuracy": ((average_accuracy or 0.0) * previous_games + self.accuracy_total) / games,
+        }
+
+
+def _greatest(column, value):
+    # GREATEST() is not portable (SQLite), so spell it out
+    current = func.coalesce(column, 0)
+    return case((current > value, current), else_=value)
+
+
+def _upsert_rollup(model):
+    """Statement adding a batch's totals to a rollup table, creating missing rows"""
+    table = model.__table__
+    stmt = _dialect_insert(database.async_engine.dialect.name)(table)
+    updates = {
+        column: table.c[column] + stmt.excluded[column]
+        for column in ("games", "wpm_total", "accuracy_total")
+    }
+    for column in ("best_wpm", "best_accuracy"):
+        if column in table.c:
+            updates[column] = _greatest(table.c[column], stmt.excluded[column])
+    if "last_played_at" in table.c:
+        updates["last_played_at"] = stmt.excluded.last_played_at
+    return stmt.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_=updates)
+
+
+def _rollup_rows(results: List[Dict[str, Any]]):
+    """Combine a batch of game rows into per-mode and per-day rollup rows"""
+    by_mode: Dict[tuple, Dict[str, Any]] = {}
+    by_day: Dict[tuple, Dict[str, Any]] = {}
+    for result in results:
+        user_id, mode, submode = key = (result["user_id"], result["mode"], result["submode"])
+        day = result["created_at"].date()
+        totals = {"user_id": user_id, "mode": mode, "submode": submode,
+                  "games": 0, "wpm_total": 0.0, "accuracy_total": 0.0, "best_wpm": 0}
+        mode_row = by_mode.setdefault(key, {**totals, "best_accuracy": 0.0, "last_played_at": None})
+        day_row = by_day.setdefault(key + (day,), {**totals, "day": day})
+        for row in (mode_row, day_row):
+            row["games"] += 1
+            row["wpm_total"] += result["wpm"]
+            row["accuracy_total"] += result["accuracy"]
+            row["best_wpm"] = max(row["best_wpm"], result["wpm"])
+        mode_row["best_accuracy"] = max(mode_row["best_accuracy"], result["accuracy"])
+        mode_row["last_played_at"] = result["created_at"]
+    return list(by_mode.values()), list(by_day.values())
+
+
+# One statement for the whole batch, run with executemany. Every right-hand
+# side reads the row as it was before the UPDATE, so the averages use the old
+# total_games like the per-game code did.
+_APPLY_STATS = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("user_id"))
+    .values(
+        best_wpm=_greatest(User.__table__.c.best_wpm, bindparam("best_wpm")),
+        best_accuracy=_greatest(User.__table__.c.best_accuracy, bindparam("best_accuracy")),
+        total_games=func.coalesce(User.__table__.c.total_games, 0) + bindparam("games"),
+        average_wpm=(
+            func.coalesce(User.__table__.c.average_wpm, 0.0) * func.coalesce(User.__table__.c.total_games, 0)
+            + bindparam("wpm_total")
+        ) / (func.coalesce(User.__table__.c.total_games, 0) + bindparam("games")),
+        average_accuracy=(
+            func.coalesce(User.__table__.c.average_accuracy, 0.0) * func.coalesce(User.__table__.c.total_games, 0)
+            + bindparam("accuracy_total")
+        ) / (func.coalesce(User.__table__.c.total_games, 0) + bindparam("games")),
+    )
+)
+
+
+class StatsWriter:
+    """Write-behind queue for finished-game stats.
+
+    Games are combined per user and written every ``STATS_FLUSH_INTERVAL``
+    seconds (or sooner once ``STATS_FLUSH_BATCH`` users are waiting) in a
+    single batched UPDATE and one commit, together with the raw game_results
+    rows and the per-mode / per-day rollups, and ``stop`` writes whatever is
+    still pending.
+
+    If the database cannot be reached the batch is put back in the queue.
+    If the batch itself is rejected, each user is retried in a transaction
+    of their own so one bad row cannot hold up everyone else; a user whose
+    games fail ``STATS_MAX_ATTEMPTS`` times is dropped to the dead-letter
+    log. The queue holds at most ``STATS_MAX_PENDING_GAMES`` games; past
+    that ``record`` raises StatsBacklogFull.
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv("STATS_FLUSH_INTERVAL", 0.5))
+        self.batch_size = int(os.getenv("STATS_FLUSH_BATCH", 500))
+        self.max_attempts = int(os.getenv("STATS_MAX_ATTEMPTS", 3))
+        self.max_pending_games = int(os.getenv("STATS_MAX_PENDING_GAMES", 50000))
+        self._pending: Dict[int, PendingStats] = {}
+        self._results: List[Dict[str, Any]] = []
+        # Failed writes per user, reset once their games are written
+        self._attempts: Dict[int, int] = {}
+        # Taken by the flush but not committed yet
+        self._inflight: Dict[int, PendingStats] = {}
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            # Created here so they belong to the running event loop
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer and write everything still queued"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"Stats writer: {len(self._pending)} users' stats could not be written on shutdown")
+            # Logged rather than lost, so they can be replayed
+            results_by_user: Dict[int, List[Dict[str, Any]]] = {}
+            for result in self._results:
+                results_by_user.setdefault(result["user_id"], []).append(result)
+            for user_id in self._pending:
+                self._dead_letter(user_id, results_by_user.get(user_id, []), "not written before shutdown")
+            self._pending, self._results = {}, []
+
+    def record(self, user_id: int, wpm: int, accuracy: float, mode: str, submode: Optional[int] = None,
+               duration: Optional[int] = None, word_count: Optional[int] = None) -> PendingStats:
+        """Queue one finished game; returns everything not yet written for the user"""
+        if len(self._results) >= self.max_pending_games:
+            STATS_REJECTED.inc()
+            raise StatsBacklogFull("Stats are backed up; please try again shortly")
+        pending = self._pending.setdefault(user_id, PendingStats())
+        pending.add(wpm, accuracy)
+        self._results.append({
+            "user_id": user_id,
+            "mode": mode,
+            "submode": submode or 0,
+            "wpm": wpm,
+            "accuracy": accuracy,
+            "duration": duration,
+            "word_count": word_count,
+            "created_at": datetime.utcnow()
+        })
+        if len(self._pending) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+        unwritten = PendingStats()
+        if user_id in self._inflight:
+            unwritten.merge(self._inflight[user_id])
+        unwritten.merge(pending)
+        return unwritten
+
+    async def flush(self):
+        """Write all queued stats in one transaction"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            self._inflight, self._pending = self._pending, {}
+            results, self._results = self._results, []
+            batch = self._inflight
+            try:
+                users = await self._write(batch, results)
+                for user_id in batch:
+                    self._attempts.pop(user_id, None)
+            except Exception as e:
+                if _is_transient(e):
+                    self._requeue(batch, results)
+                    print(f"Stats writer: failed to write {len(batch)} users' stats: {e}")
+                    return
+                print(f"Stats writer: batch of {len(batch)} users rejected ({e}); retrying them one by one")
+                users = await self._write_each(batch, results)
+            finally:
+                self._inflight = {}
+
+        # Scores only move up, so this is a no-op unless a best improved
+        for user in users:
+            try:
+                await leaderboard.submit(str(user.id), user.username, user.best_wpm, user.best_accuracy, user.total_games)
+            except Exception as e:
+                print(f"Stats writer: failed to update leaderboard for user {user.id}: {e}")
+
+    async def _write(self, batch: Dict[int, PendingStats], results: List[Dict[str, Any]]):
+        """Apply a batch in one transaction; returns the users' updated leaderboard rows"""
+        async with database.async_engine.begin() as conn:
+            await conn.execute(_APPLY_STATS, [
+                {
+                    "user_id": user_id,
+                    "games": stats.games,
+                    "wpm_total": stats.wpm_total,
+                    "accuracy_total": stats.accuracy_total,
+                    "best_wpm": stats.best_wpm,
+                    "best_accuracy": stats.best_accuracy,
+                }
+                for user_id, stats in batch.items()
+            ])
+            await conn.execute(insert(GameResult), results)
+            mode_rows, day_rows = _rollup_rows(results)
+            await conn.execute(_upsert_rollup(UserModeStats), mode_rows)
+            await conn.execute(_upsert_rollup(UserDailyStats), day_rows)
+            return (await conn.execute(
+                select(User.id, User.username, User.best_wpm, User.best_accuracy, User.total_games)
+                .where(User.id.in_(batch))
+            )).all()
+
+    async def _write_each(self, batch: Dict[int, PendingStats], results: List[Dict[str, Any]]):
+        """Write a rejected batch user by user, isolating the rows that fail"""
+        results_by_user: Dict[int, List[Dict[str, Any]]] = {}
+        for result in results:
+            results_by_user.setdefault(result["user_id"], []).append(result)
+
+        users = []
+        for user_id, stats in batch.items():
+            user_results = results_by_user.get(user_id, [])
+            try:
+                users.extend(await self._write({user_id: stats}, user_results))
+                self._attempts.pop(user_id, None)
+                continue
+            except Exception as e:
+                error = e
+            attempts = self._attempts.get(user_id, 0) + (0 if _is_transient(error) else 1)
+            if attempts >= self.max_attempts:
+                self._attempts.pop(user_id, None)
+                self._dead_letter(user_id, user_results, str(error))
+            else:
+                self._attempts[user_id] = attempts
+                self._requeue({user_id: stats}, user_results)
+        return users
+
+    def _requeue(self, batch: Dict[int, PendingStats], results: List[Dict[str, Any]]):
+        # Keep the games; newer ones queued meanwhile are merged in
+        for user_id, stats in batch.items():
+            self._pending.setdefault(user_id, PendingStats()).merge(stats)
+        self._results[:0] = results
+
+    def _dead_letter(self, user_id: int, results: List[Dict[str, Any]], reason: str):
+        STATS_DEAD_LETTERS.inc()
+        entry = {"event": "stats_dead_letter", "user_id": user_id, "reason": reason, "games": results}
+        try:
+            # One JSON line with everything needed to replay the games by hand
+            print(codec.dumps_str(entry))
+        except (TypeError, ValueError):
+            # The bad value may not even encode (e.g. an int past 64 bits)
+            print(repr(entry))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+stats_writer = StatsWriter()
@@ -0,0 +1,177 @@
+"""Bloom filter of taken usernames, kept in a Redis bitmap.
+
+A username whose bits are not all set has never been taken, so most
+availability checks (one per keystroke on the SetUsername page) are
+answered by one pipelined round trip without touching the database. A hit
+may be a false positive (about ``USERNAME_FILTER_ERROR_RATE`` of them at
+``USERNAME_FILTER_CAPACITY`` names), so hits are confirmed against the
+database. Names given up by a rename stay in the filter and only cost that
+confirmation.
+
+The bitmap's size and hash count are part of its key, so changing either
+setting starts a fresh filter rather than misreading the old one. The key
+only exists once a build has finished: builds write a temporary key and
+rename it into place, and adding a name to a missing filter is a no-op, so
+a half-built or nearly empty bitmap is never trusted. Names added while a
+build runs are also set in the build's own bitmap, so it cannot miss them. The filter is built
+in the background at startup when it is missing (or by hand, with
+``--reset`` to drop stale names first):
+
+    python -m app.utils.username_filter [--reset]
+
+Until then, and whenever Redis fails, checks go to the database. The
+unique index on ``users.username_lower`` stays the source of truth.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+from typing import Iterable, List, Optional
+
+from app.config.db import SessionLocal
+from app.config.redis_config import redis_manager
+from app.models.sqlalchemy_user import User
+from app.utils import metrics
+
+USERNAME_CHECKS = metrics.Counter(
+    "rapidkeys_username_checks_total", "Username availability checks by what answered them", ["source"]
+)
+
+# KEYS: filter, rebuild bitmap, rebuilding marker; ARGV: bit offsets. Only
+# sets bits in a filter that has been built, and in a build in progress
+ADD_SCRIPT = """
+local targets = {}
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    table.insert(targets, KEYS[1])
+end
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    table.insert(targets, KEYS[2])
+end
+for _, key in ipairs(targets) do
+    for _, offset in ipairs(ARGV) do
+        redis.call('SETBIT', key, offset, 1)
+    end
+end
+return #targets
+"""
+
+
+class UsernameFilter:
+    def __init__(self, redis_manager, capacity: Optional[int] = None, error_rate: Optional[float] = None):
+        self.redis_manager = redis_manager
+        capacity = capacity or int(os.getenv("USERNAME_FILTER_CAPACITY", 1_000_000))
+        error_rate = error_rate or float(os.getenv("USERNAME_FILTER_ERROR_RATE", 0.01))
+        # Standard Bloom filter sizing for the expected number of names
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.key = f"usernames:bloom:{self.size}:{self.hashes}"
+        self.rebuild_key = f"{self.key}:rebuild"
+        self.rebuilding_key = f"{self.key}:rebuilding"
+        self.build_lock_ttl = int(os.getenv("USERNAME_FILTER_BUILD_LOCK_TTL", 300))
+        self._add_script = None
+
+    @property
+    def redis_client(self):
+        return self.redis_manager.redis_client
+
+    def _offsets(self, username: str) -> List[int]:
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(username.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    async def might_contain(self, username: str) -> Optional[bool]:
+        """False if ``username`` (normalized) was never taken; None if the filter cannot tell"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.exists(self.key)
+        for offset in self._offsets(username):
+            pipe.getbit(self.key, offset)
+        try:
+            exists, *bits = await pipe.execute()
+        except Exception as e:
+            print(f"Username filter unavailable: {e}")
+            return None
+        if not exists:
+            return None
+        return all(bits)
+
+    async def add(self, username: str):
+        """Mark a (normalized) username as taken; a no-op until the filter is built"""
+        if self._add_script is None:
+            self._add_script = self.redis_client.register_script(ADD_SCRIPT)
+        try:
+            # Falls back to EVAL after a Redis restart
+            await self._add_script(
+                keys=[self.key, self.rebuild_key, self.rebuilding_key],
+                args=self._offsets(username),
+                client=self.redis_client
+            )
+        except Exception as e:
+            # The database still rejects the name; the filter just misses it
+            print(f"Error adding {username!r} to the username filter: {e}")
+
+    def _bitmap(self, usernames: Iterable[str]) -> bytes:
+        # Redis numbers bits from the most significant bit of the first byte
+        bits = bytearray((self.size + 7) // 8)
+        for username in usernames:
+            for offset in self._offsets(username):
+                bits[offset >> 3] |= 0x80 >> (offset & 7)
+        return bytes(bits)
+
+    def _bitmap_from_db(self) -> bytes:
+        with SessionLocal() as db:
+            rows = db.query(User.username_lower).filter(User.username_lower.isnot(None)).yield_per(1000)
+            return self._bitmap(username for username, in rows)
+
+    async def rebuild(self, reset: bool = False):
+        """Add every username in the database to the filter.
+
+        The bitmap is built off the event loop, OR-ed with the names added
+        since the build started (and with the live filter, if any) and
+        renamed into place in one MULTI/EXEC. ``reset`` skips the live
+        filter, dropping names no longer in use.
+        """
+        snapshot_key = f"{self.key}:snapshot"
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(self.rebuild_key)
+        # From here on add() also sets bits in rebuild_key
+        pipe.set(self.rebuilding_key, 1, ex=self.build_lock_ttl)
+        await pipe.execute()
+        bitmap = await asyncio.to_thread(self._bitmap_from_db)
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.set(snapshot_key, bitmap)
+        sources = [self.rebuild_key, snapshot_key] + ([] if reset else [self.key])
+        pipe.bitop("OR", self.rebuild_key, *sources)
+        pipe.rename(self.rebuild_key, self.key)
+        pipe.delete(snapshot_key, self.rebuilding_key)
+        await pipe.execute()
+
+    async def ensure_built(self):
+        """Build the filter if no worker has yet; run in the background at startup"""
+        try:
+            if await self.redis_client.exists(self.key):
+                return
+            lock_key = f"{self.key}:building"
+            if not await self.redis_client.set(lock_key, 1, nx=True, ex=self.build_lock_ttl):
+                return  # Another worker is on it
+            try:
+                await self.rebuild()
+                print("Username filter built")
+            finally:
+                await self.redis_client.delete(lock_key)
+        except Exception as e:
+            print(f"Error building username filter: {e}")
+
+
+username_filter = UsernameFilter(redis_manager)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the username Bloom filter from the database")
+    parser.add_argument("--reset", action="store_true", help="start from an empty filter")
+    args = parser.parse_args()
+    asyncio.run(username_filter.rebuild(reset=args.reset))
+    print(f"Rebuilt {username_filter.key}")
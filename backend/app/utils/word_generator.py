@@ -1,4 +1,6 @@
 import random
+from itertools import islice
+from typing import Iterator, Optional
 
 COMMON_WORDS = [
   "word", "buy", "too", "frighten", "some", "saw", "offer", "possible", "never", "chest",
@@ -17,16 +19,55 @@ COMMON_WORDS = [
   "food", "bread", "rice", "milk", "cheese", "butter", "egg", "meat", "fish", "soup"
 ]
 
-def generate_words(mode: str, submode: int) -> list[str]:
+# Word lists are versioned so a race can be replayed from (corpus_version, seed, count).
+# Never edit a published corpus in place; add a new version instead. The frontend
+# keeps an identical copy in src/lib/utils.js.
+CORPORA = {
+    1: COMMON_WORDS,
+}
+CORPUS_VERSION = 1
+
+# Words shipped up front for time mode; clients generate more as they type
+TIME_MODE_INITIAL_WORDS = 150
+
+
+def _mulberry32(seed: int) -> Iterator[int]:
+    """32-bit PRNG that is cheap to reproduce bit-for-bit in JavaScript"""
+    state = seed & 0xFFFFFFFF
+    while True:
+        state = (state + 0x6D2B79F5) & 0xFFFFFFFF
+        t = ((state ^ (state >> 15)) * (state | 1)) & 0xFFFFFFFF
+        t ^= (t + (((t ^ (t >> 7)) * (t | 61)) & 0xFFFFFFFF)) & 0xFFFFFFFF
+        yield (t ^ (t >> 14)) & 0xFFFFFFFF
+
+
+def words_from_spec(text: dict, start: int = 0, count: Optional[int] = None) -> list[str]:
+    """Rebuild words ``start`` .. ``start + count`` of the text described by ``text``"""
+    corpus = CORPORA[text["corpus_version"]]
+    if count is None:
+        count = text["count"] if text.get("count") is not None else TIME_MODE_INITIAL_WORDS
+        count -= start
+    rng = islice(_mulberry32(text["seed"]), start, start + max(count, 0))
+    return [corpus[value % len(corpus)] for value in rng]
+
+
+def new_text_spec(mode: str, submode: int) -> dict:
+    """Describe a fresh race text; ``count`` is None for open-ended time mode"""
     if mode == "words":
         if submode not in [10, 25, 50, 75]:
             raise ValueError("Invalid submode for words mode. Must be 10, 25, 50, or 75.")
-        return random.choices(COMMON_WORDS, k=submode)
+        count = submode
 
     elif mode == "time":
         if submode not in [15, 30, 60, 100]:
             raise ValueError("Invalid submode for time mode. Must be 15, 30, 60, or 100.")
-        return random.choices(COMMON_WORDS, k=150)
+        count = None
 
     else:
-        raise ValueError("Mode must be either 'words' or 'time'.")
\ No newline at end of file
+        raise ValueError("Mode must be either 'words' or 'time'.")
+
+    return {
+        "corpus_version": CORPUS_VERSION,
+        "seed": random.getrandbits(32),
+        "count": count
+    }
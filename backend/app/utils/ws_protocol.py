@@ -0,0 +1,96 @@
+"""Negotiated WebSocket codecs for the multiplayer endpoint.
+
+Clients offer subprotocols in the handshake. ``rapidkeys.bin.v1`` switches the
+hot message types to fixed-layout little-endian binary frames; every other
+message, and every client that offers nothing or ``rapidkeys.json``, stays on
+JSON text frames.
+
+Binary frames start with a one-byte tag:
+
+    typing_progress   (client -> server)
+        u8 tag=1 | u8 progress | u16 wpm | u16 accuracy * 100
+
+    progress_snapshot (server -> client)
+        u8 tag=2 | u16 count | count * (u16 slot | u8 progress | u16 wpm | u16 accuracy * 100)
+
+Users are identified by the integer ``slot`` they are given when they join a
+room (sent in the JSON room/user payloads) instead of their id.
+"""
+import math
+import struct
+from typing import Any, Dict, Iterable, Optional
+
+JSON_SUBPROTOCOL = "rapidkeys.json"
+BINARY_SUBPROTOCOL = "rapidkeys.bin.v1"
+SUPPORTED_SUBPROTOCOLS = (BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+TYPING_PROGRESS_TAG = 1
+PROGRESS_SNAPSHOT_TAG = 2
+
+_TYPING_PROGRESS = struct.Struct("<BBHH")
+_SNAPSHOT_HEADER = struct.Struct("<BH")
+_SNAPSHOT_ENTRY = struct.Struct("<HBHH")
+
+# Upper bounds of the typing_progress fields, whichever codec they came in
+PROGRESS_LIMITS = {"progress": 100, "wpm": 500, "accuracy": 100}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def negotiate(offered: Iterable[str]) -> Optional[str]:
+    """Pick the first supported subprotocol the client offered, if any"""
+    for subprotocol in offered:
+        if subprotocol in SUPPORTED_SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def _clamp(value, low: int, high: int) -> int:
+    return max(low, min(high, int(round(value or 0))))
+
+
+def progress_fields(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """A typing_progress frame's fields clamped to their ranges, or None if one is not a number"""
+    fields = {}
+    for name, high in PROGRESS_LIMITS.items():
+        value = message.get(name, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return None
+        fields[name] = max(0, min(high, value))
+    return fields
+
+
+def decode_binary(data: bytes) -> Dict[str, Any]:
+    """Decode an inbound binary frame into the same dict a JSON frame would give"""
+    if not data:
+        raise ProtocolError("Empty binary frame")
+    if data[0] == TYPING_PROGRESS_TAG and len(data) == _TYPING_PROGRESS.size:
+        _, progress, wpm, accuracy = _TYPING_PROGRESS.unpack(data)
+        return {"type": "typing_progress", "progress": progress, "wpm": wpm, "accuracy": accuracy / 100}
+    raise ProtocolError(f"Unknown binary frame tag {data[0]}")
+
+
+def encode_binary(message: Dict[str, Any]) -> Optional[bytes]:
+    """Encode a hot outbound message, or return None if it should go out as JSON"""
+    if message.get("type") != "progress_snapshot":
+        return None
+    entries = [entry for entry in message["users"].values() if entry.get("slot") is not None]
+    if len(entries) != len(message["users"]):
+        # Someone without a slot cannot be addressed in binary; fall back to JSON
+        return None
+
+    frame = bytearray(_SNAPSHOT_HEADER.pack(PROGRESS_SNAPSHOT_TAG, len(entries)))
+    try:
+        for entry in entries:
+            frame += _SNAPSHOT_ENTRY.pack(
+                _clamp(entry["slot"], 0, 0xFFFF),
+                _clamp(entry.get("progress"), 0, 0xFF),
+                _clamp(entry.get("wpm"), 0, 0xFFFF),
+                _clamp((entry.get("accuracy") or 0) * 100, 0, 10000),
+            )
+    except (TypeError, ValueError, OverflowError):
+        # A value that is not a finite number; JSON can still carry it
+        return None
+    return bytes(frame)
@@ -0,0 +1,159 @@
+"""Per-socket outbound queue drained by its own writer task.
+
+Handlers queue a frame for each socket in a room and move on, so a client on
+a bad network only delays itself. Progress snapshots are latest-wins: a
+snapshot still waiting when the next one arrives is merged into it and sent
+once. Every other frame (chat, joins, race control) is sent in order, from a
+queue bounded by ``WS_SEND_QUEUE_FRAMES`` frames and ``WS_SEND_QUEUE_BYTES``
+characters. A socket whose queue overflows, or whose send takes longer than
+``WS_SEND_TIMEOUT``, is closed as a slow consumer.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from app.utils import codec, metrics, ws_protocol
+
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 2))
+MAX_QUEUED_FRAMES = int(os.getenv("WS_SEND_QUEUE_FRAMES", 256))
+MAX_QUEUED_BYTES = int(os.getenv("WS_SEND_QUEUE_BYTES", 1024 * 1024))
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+WS_FRAMES_SENT = metrics.Counter(
+    "rapidkeys_websocket_frames_sent_total", "Frames sent to clients, by message type", ["type"]
+)
+WS_FRAMES_COALESCED = metrics.Counter(
+    "rapidkeys_websocket_frames_coalesced_total", "Progress snapshots merged into a newer one before they were sent"
+)
+WS_SEND_FAILURES = metrics.Counter(
+    "rapidkeys_websocket_send_failures_total", "Sockets closed because sending to them failed, by reason", ["reason"]
+)
+
+Payload = Union[bytes, str]
+
+
+def _merge_snapshots(pending: Dict[str, Any], latest: Dict[str, Any]) -> Dict[str, Any]:
+    # Snapshots only carry users who moved since the last tick, so keep
+    # everyone from the older one and let the newer one win per user
+    return {**latest, "users": {**pending["users"], **latest["users"]}}
+
+
+# Message types a newer frame may replace, and how to fold them together
+LATEST_WINS = {"progress_snapshot": _merge_snapshots}
+
+
+class ConnectionSender:
+    """Outbound queue and writer task for one WebSocket"""
+
+    def __init__(self, websocket: WebSocket, subprotocol: Optional[str],
+                 on_failure: Callable[["ConnectionSender"], None]):
+        self.websocket = websocket
+        self.subprotocol = subprotocol
+        self._on_failure = on_failure
+        self._frames: Deque[Tuple[Payload, str]] = deque()
+        self.queued_bytes = 0
+        # Latest-wins frames by type: (encoded payload or None, message)
+        self._latest: Dict[str, Tuple[Optional[Payload], Dict[str, Any]]] = {}
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.close_reason: Optional[str] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._frames) + len(self._latest)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, payload: Payload, message_type: str, message: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a frame; False if the socket is closed or has just fallen too far behind.
+
+        ``message`` is the decoded frame, needed to merge latest-wins types.
+        """
+        if self.closed:
+            return False
+        merge = LATEST_WINS.get(message_type)
+        if merge is not None and message is not None:
+            pending = self._latest.get(message_type)
+            if pending is None:
+                self._latest[message_type] = (payload, message)
+            else:
+                # Re-encoded by the writer, for this socket's protocol
+                self._latest[message_type] = (None, merge(pending[1], message))
+                WS_FRAMES_COALESCED.inc()
+        else:
+            if len(self._frames) >= MAX_QUEUED_FRAMES or self.queued_bytes + len(payload) > MAX_QUEUED_BYTES:
+                self._fail("queue_full")
+                return False
+            self._frames.append((payload, message_type))
+            self.queued_bytes += len(payload)
+        self._ready.set()
+        return True
+
+    async def close(self):
+        """Stop the writer and close the socket (a no-op if the client already went away)"""
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._frames.clear()
+        self._latest.clear()
+        try:
+            if self.close_reason in ("queue_full", "send_timeout"):
+                await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Slow consumer")
+            else:
+                await self.websocket.close()
+        except Exception:
+            pass
+
+    def _next(self) -> Optional[Tuple[Payload, str]]:
+        if self._frames:
+            payload, message_type = self._frames.popleft()
+            self.queued_bytes -= len(payload)
+            return payload, message_type
+        if self._latest:
+            message_type = next(iter(self._latest))
+            payload, message = self._latest.pop(message_type)
+            return (payload if payload is not None else self._encode(message)), message_type
+        return None
+
+    def _encode(self, message: Dict[str, Any]) -> Payload:
+        if self.subprotocol == ws_protocol.BINARY_SUBPROTOCOL:
+            binary = ws_protocol.encode_binary(message)
+            if binary is not None:
+                return binary
+        return codec.dumps_str(message)
+
+    async def _run(self):
+        while not self.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while not self.closed:
+                frame = self._next()
+                if frame is None:
+                    break
+                payload, message_type = frame
+                send = (self.websocket.send_bytes(payload) if isinstance(payload, bytes)
+                        else self.websocket.send_text(payload))
+                try:
+                    await asyncio.wait_for(send, timeout=SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self._fail("send_timeout")
+                    return
+                except Exception:
+                    # Usually the client is gone; the receive loop notices too
+                    self._fail("send_error")
+                    return
+                WS_FRAMES_SENT.labels(message_type).inc()
+
+    def _fail(self, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        WS_SEND_FAILURES.labels(reason).inc()
+        self._on_failure(self)
@@ -0,0 +1,129 @@
+"""Broadcast latency against room size.
+
+Fills a room in ConnectionManager's local index with fake sockets whose
+send_text takes a random delay. For each round it times how long
+broadcast_to_room takes to queue the frame and how long until every
+socket's writer has sent it. Optionally makes one socket stall, to show
+that the rest of the room is unaffected and that the stalled socket is
+dropped after WS_SEND_TIMEOUT.
+
+    python -m benchmarks.broadcast_latency --sizes 2 5 10 25 50 100 --rounds 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("REDIS_CLOUD_URL", "redis://localhost:6379")
+os.environ.setdefault("DB_URL", "postgresql://localhost/rapidkeys")
+os.environ.setdefault("MULTIPLAYER_PUBSUB", "0")
+
+import functools  # noqa: E402
+
+from app.routes import multiplayer  # noqa: E402
+from app.utils import ws_sender  # noqa: E402
+
+
+class FakeWebSocket:
+    def __init__(self, min_delay: float, max_delay: float, delivered: "Delivered", stalled: bool = False):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delivered = delivered
+        self.stalled = stalled
+        self.closed = False
+
+    async def send_text(self, payload: str):
+        if self.stalled:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(random.uniform(self.min_delay, self.max_delay))
+        self.delivered.add()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+
+class Delivered:
+    """Counts frames sent across the room and wakes a waiter at a target"""
+
+    def __init__(self):
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+
+    def expect(self, frames: int):
+        self.count = 0
+        self.target = frames
+        self.done.clear()
+
+    def add(self):
+        self.count += 1
+        if self.count >= self.target:
+            self.done.set()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def bench_room(size: int, rounds: int, min_delay: float, max_delay: float, stalled: bool):
+    manager = multiplayer.ConnectionManager()
+    room_code = f"BENCH{size}"
+    delivered = Delivered()
+    sockets = []
+    for i in range(size):
+        user_id = str(i)
+        websocket = FakeWebSocket(min_delay, max_delay, delivered, stalled and i == 0)
+        sockets.append(websocket)
+        sender = ws_sender.ConnectionSender(websocket, None, functools.partial(manager._drop_connection, user_id))
+        sender.start()
+        manager.senders[user_id] = sender
+        manager.active_connections[user_id] = websocket
+        manager.room_connections.setdefault(room_code, set()).add(user_id)
+        manager.connection_rooms[user_id] = room_code
+
+    message = {
+        "type": "progress_snapshot",
+        "users": {str(i): {"progress": 50, "wpm": 80, "accuracy": 97.5} for i in range(size)}
+    }
+    queue_samples, delivery_samples = [], []
+    for _ in range(rounds):
+        delivered.expect(size - 1 if stalled else size)
+        start = time.perf_counter()
+        await manager.broadcast_to_room(room_code, message)
+        queue_samples.append((time.perf_counter() - start) * 1000)
+        await delivered.done.wait()
+        delivery_samples.append((time.perf_counter() - start) * 1000)
+
+    if stalled:
+        # Give the stalled socket's send time to run out
+        await asyncio.sleep(ws_sender.SEND_TIMEOUT + 0.1)
+    dropped = sum(websocket.closed for websocket in sockets)
+    await manager.close()
+    return queue_samples, delivery_samples, dropped
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 5, 10, 25, 50, 100])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--min-delay", type=float, default=0.0005, help="seconds")
+    parser.add_argument("--max-delay", type=float, default=0.005, help="seconds")
+    parser.add_argument("--stalled", action="store_true", help="make one socket never finish sending")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print(f"{'room size':>10} {'queue p50 ms':>13} {'queue max ms':>13} "
+          f"{'sent p50 ms':>12} {'sent p95 ms':>12} {'sent p99 ms':>12} {'sent max ms':>12} {'dropped':>8}")
+    for size in args.sizes:
+        queued, sent, dropped = await bench_room(size, args.rounds, args.min_delay, args.max_delay, args.stalled)
+        print(f"{size:>10} {statistics.median(queued):>13.3f} {max(queued):>13.3f} "
+              f"{statistics.median(sent):>12.2f} {percentile(sent, 95):>12.2f} "
+              f"{percentile(sent, 99):>12.2f} {max(sent):>12.2f} {dropped:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Serialization backends on real room payloads.
+
+Times encode and decode of the frames and Redis values the multiplayer code
+actually produces (a full room_joined state, a progress snapshot, a chat
+message, a single user hash field) with every JSON backend that is installed,
+and reports which one app.utils.codec picked.
+
+    python -m benchmarks.codec_backends --users 8 --number 20000
+"""
+import argparse
+import json
+import timeit
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.utils import codec
+
+
+def room_payloads(users: int):
+    now = datetime.now(timezone.utc)
+    room_users = {
+        str(i): {
+            "id": str(i),
+            "username": f"racer{i}",
+            "joined_at": (now + timedelta(seconds=i)).isoformat(),
+            "wpm": 60 + i,
+            "accuracy": 95.5,
+            "progress": 10 * i,
+            "is_host": i == 0,
+            "slot": i
+        }
+        for i in range(users)
+    }
+    messages = [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": str(i % users),
+            "username": f"racer{i % users}",
+            "message": "gl hf everyone, last one to finish buys coffee",
+            "timestamp": (now + timedelta(seconds=i)).isoformat()
+        }
+        for i in range(20)
+    ]
+    return {
+        "room_joined": {
+            "type": "room_joined",
+            "room": {
+                "code": "ABC123",
+                "creator_id": "0",
+                "created_at": now.isoformat(),
+                "race_started": False,
+                "text": {"corpus_version": 1, "seed": 123456789, "count": 50},
+                "settings": {"mode": "words", "value": 50, "difficulty": "medium"},
+                "users": room_users,
+                "messages": messages
+            },
+            "your_id": "0"
+        },
+        "progress_snapshot": {
+            "type": "progress_snapshot",
+            "users": {uid: {"progress": 50, "wpm": 80, "accuracy": 97.5, "slot": u["slot"]} for uid, u in room_users.items()}
+        },
+        "chat_message": {"type": "chat_message", "message": messages[0]},
+        "user_field": room_users["0"]["username"],
+    }
+
+
+def backends():
+    found = {"json": (lambda obj: json.dumps(obj).encode("utf-8"), json.loads)}
+    try:
+        import orjson
+        found["orjson"] = (orjson.dumps, orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        found["ujson"] = (lambda obj: ujson.dumps(obj).encode("utf-8"), ujson.loads)
+    except ImportError:
+        pass
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"app.utils.codec backend: {codec.BACKEND}")
+    print(f"{'payload':>18} {'backend':>8} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, payload in room_payloads(args.users).items():
+        for backend, (dumps, loads) in backends().items():
+            encoded = dumps(payload)
+            encode_us = timeit.timeit(lambda: dumps(payload), number=args.number) / args.number * 1e6
+            decode_us = timeit.timeit(lambda: loads(encoded), number=args.number) / args.number * 1e6
+            print(f"{name:>18} {backend:>8} {len(encoded):>7} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cold import time of app.main, checked against a budget.
+
+Each run imports the app in a fresh interpreter, the way a new worker does,
+with DB_URL and REDIS_CLOUD_URL empty: importing must not need (or touch)
+either service. Reports the median wall time and the modules with the most
+self time (from -X importtime), and exits non-zero when the median is over
+--budget-ms.
+
+    python -m benchmarks.import_time --runs 7 --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Median on a small dev VM after startup was made lazy was ~1.1s, most of it
+# FastAPI/pydantic and SQLAlchemy themselves; the rest is headroom
+DEFAULT_BUDGET_MS = 1500
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import app.main; "
+    "print((time.perf_counter() - start) * 1000)"
+)
+
+
+def clean_env():
+    env = os.environ.copy()
+    # Empty rather than unset, so a developer's .env cannot fill them back in
+    for name in ("DB_URL", "ASYNC_DB_URL", "REDIS_CLOUD_URL"):
+        env[name] = ""
+    return env
+
+
+def time_import(env) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(env, top: int):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    env = clean_env()
+    samples = [time_import(env) for _ in range(args.runs)]
+    median = statistics.median(samples)
+
+    print(f"import app.main: median {median:.0f}ms, min {min(samples):.0f}ms, max {max(samples):.0f}ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f}ms)")
+    print(f"\n{'self ms':>8} {'cumulative ms':>14}  module")
+    for self_us, cumulative_us, name in slowest_modules(env, args.top):
+        print(f"{self_us / 1000:8.1f} {cumulative_us / 1000:14.1f}  {name}")
+
+    if median > args.budget_ms:
+        print(f"\nOver budget by {median - args.budget_ms:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
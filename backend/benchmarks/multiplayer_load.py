@@ -0,0 +1,323 @@
+"""Multiplayer load test: N rooms x M WebSocket clients playing scripted races.
+
+Starts the app in a uvicorn subprocess, against REDIS_CLOUD_URL or, with
+--fake-redis, an in-memory fakeredis stand-in (pip install fakeredis lupa),
+and a scratch SQLite database. Every room then plays the same script:
+
+  1. all clients join /api/v1/multiplayer/ws/{room_code}
+  2. the host starts the race
+  3. each racer reports typing_progress at --progress-hz and sends a chat
+     line every --chat-every seconds, for --duration seconds
+
+Reported:
+  - chat latency: send to receipt by every client in the room (fan-out)
+  - progress latency: typing_progress send to the snapshot carrying it
+    (includes the aggregator tick)
+  - frames/sec sent and received
+  - Redis commands per inbound frame and per delivered frame
+  - server RSS per connection
+
+The script is fully determined by the arguments and --seed, so two runs of
+the same commit should agree; write --output and diff it to catch
+regressions.
+
+    python -m benchmarks.multiplayer_load --rooms 10 --clients 4 --duration 10 --fake-redis
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+STATS_PATH = "/__bench__/stats"
+# Give up instead of hanging when a join or race start never arrives
+STEP_TIMEOUT = 10
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def serve(args):
+    """Run the app in this process, counting every Redis command it sends"""
+    import redis.asyncio.connection
+    import uvicorn
+
+    commands = {"count": 0}
+    pack_command = redis.asyncio.connection.AbstractConnection.pack_command
+
+    def counting_pack_command(self, *command):
+        # Pipelines pack each of their commands through here as well
+        commands["count"] += 1
+        return pack_command(self, *command)
+
+    redis.asyncio.connection.AbstractConnection.pack_command = counting_pack_command
+
+    from app.config.redis_config import redis_manager
+    if args.fake_redis:
+        import fakeredis
+        redis_manager.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    from app.main import app
+
+    @app.get(STATS_PATH, include_in_schema=False)
+    async def bench_stats():
+        return {"redis_commands": commands["count"], "rss_bytes": rss_bytes()}
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self):
+        self.chat_sent_at = {}
+        self.progress_sent_at = {}
+        self.chat_latency = []
+        self.progress_latency = []
+        self.frames_sent = 0
+        self.frames_received = defaultdict(int)
+
+
+async def run_client(url, user_id, is_host, args, rng, recorder, joined, go, started):
+    import websockets
+
+    async with websockets.connect(url, max_size=None) as ws:
+        seen_progress = {}
+
+        async def receive():
+            async for raw in ws:
+                now = time.perf_counter()
+                message = json.loads(raw)
+                recorder.frames_received[message["type"]] += 1
+                if message["type"] == "room_joined":
+                    joined.release()
+                elif message["type"] == "race_started":
+                    started.set()
+                elif message["type"] == "chat_message":
+                    sent_at = recorder.chat_sent_at.get(message["message"]["message"])
+                    if sent_at is not None:
+                        recorder.chat_latency.append((now - sent_at) * 1000)
+                elif message["type"] == "progress_snapshot":
+                    for other_id, progress in message["users"].items():
+                        sent_at = recorder.progress_sent_at.get((other_id, progress["progress"]))
+                        if other_id != user_id and sent_at is not None and seen_progress.get(other_id) != progress["progress"]:
+                            seen_progress[other_id] = progress["progress"]
+                            recorder.progress_latency.append((now - sent_at) * 1000)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            await go.wait()
+            if is_host:
+                await ws.send(json.dumps({"type": "start_race"}))
+                recorder.frames_sent += 1
+            await asyncio.wait_for(started.wait(), timeout=STEP_TIMEOUT)
+            # Spread racers over the first tick so they do not all fire at once
+            await asyncio.sleep(rng.uniform(0, 1 / args.progress_hz))
+            ticks = int(args.duration * args.progress_hz)
+            chat_every = max(1, int(args.chat_every * args.progress_hz))
+            for tick in range(1, ticks + 1):
+                progress = tick * 100 // ticks
+                recorder.progress_sent_at[(user_id, progress)] = time.perf_counter()
+                await ws.send(json.dumps({"type": "typing_progress", "progress": progress, "wpm": 60, "accuracy": 97.5}))
+                recorder.frames_sent += 1
+                if tick % chat_every == 0:
+                    text = f"{user_id}:{tick}"
+                    recorder.chat_sent_at[text] = time.perf_counter()
+                    await ws.send(json.dumps({"type": "chat_message", "message": text}))
+                    recorder.frames_sent += 1
+                await asyncio.sleep(1 / args.progress_hz)
+            # Let the last snapshots and chat lines drain
+            await asyncio.sleep(0.5)
+        finally:
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+
+
+async def create_room(base_url, host_token, args) -> str:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        response = await client.post(
+            "/api/v1/multiplayer/create-room",
+            # The race itself runs for --duration; the room setting only picks the text
+            json={"mode": "time", "value": 30},
+            headers={"Authorization": f"Bearer {host_token}"}
+        )
+        response.raise_for_status()
+        return response.json()["room_code"]
+
+
+async def server_stats(base_url):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        return (await client.get(STATS_PATH)).json()
+
+
+def create_users(count: int):
+    """Insert the load-test users straight into the scratch database"""
+    import jwt
+    from app.config.db import SessionLocal
+    from app.migrate import migrate
+    from app.models.sqlalchemy_user import User
+
+    migrate()
+    with SessionLocal() as db:
+        users = [User(username=f"load{i}", email=f"load{i}@load.test", password=None) for i in range(count)]
+        db.add_all(users)
+        db.commit()
+        return [
+            (str(user.id), jwt.encode({"sub": str(user.id)}, os.environ["JWT_SECRET"], algorithm="HS256"))
+            for user in users
+        ]
+
+
+async def wait_for_server(base_url, timeout: float = 30):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                await client.get(STATS_PATH)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def drive(args, base_url, ws_base):
+    await wait_for_server(base_url)
+    users = create_users(args.rooms * args.clients)
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+
+    baseline = await server_stats(base_url)
+    go = asyncio.Event()
+    clients = []
+    for room in range(args.rooms):
+        tokens = users[room * args.clients:(room + 1) * args.clients]
+        room_code = await create_room(base_url, tokens[0][1], args)
+        joined = asyncio.Semaphore(0)
+        started = asyncio.Event()
+        for index, (user_id, token) in enumerate(tokens):
+            url = f"{ws_base}/api/v1/multiplayer/ws/{room_code}?token={token}"
+            clients.append(asyncio.create_task(run_client(
+                url, user_id, index == 0, args, random.Random(rng.random()), recorder, joined, go, started
+            )))
+            # Join one at a time so every room fills the same way each run
+            await asyncio.wait_for(joined.acquire(), timeout=STEP_TIMEOUT)
+    connected = await server_stats(base_url)
+
+    start = time.perf_counter()
+    go.set()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+    finished = await server_stats(base_url)
+
+    connections = args.rooms * args.clients
+    received = sum(recorder.frames_received.values())
+    race_frames_received = received - recorder.frames_received["room_joined"] - recorder.frames_received["user_joined"]
+    redis_commands = finished["redis_commands"] - connected["redis_commands"]
+    return {
+        "rooms": args.rooms,
+        "clients_per_room": args.clients,
+        "duration": args.duration,
+        "progress_hz": args.progress_hz,
+        "seed": args.seed,
+        "chat_latency_ms": summarize(recorder.chat_latency),
+        "progress_latency_ms": summarize(recorder.progress_latency),
+        "frames_sent_per_sec": round(recorder.frames_sent / elapsed, 1),
+        "frames_received_per_sec": round(race_frames_received / elapsed, 1),
+        "frames_received_by_type": dict(sorted(recorder.frames_received.items())),
+        "redis_commands_per_inbound_frame": round(redis_commands / max(1, recorder.frames_sent), 2),
+        "redis_commands_per_delivered_frame": round(redis_commands / max(1, race_frames_received), 2),
+        "rss_bytes_per_connection": (connected["rss_bytes"] - baseline["rss_bytes"]) // connections,
+    }
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50": round(statistics.median(samples), 2),
+        "p95": round(percentile(samples, 95), 2),
+        "p99": round(percentile(samples, 99), 2),
+        "max": round(max(samples), 2),
+    }
+
+
+async def bench(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ws_base = f"ws://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp(prefix="rapidkeys-load-")
+    os.environ.update({
+        "DB_URL": f"sqlite:///{workdir}/load.db",
+        "JWT_SECRET": os.getenv("JWT_SECRET", "load-test-secret"),
+        "REDIS_CLOUD_URL": os.getenv("REDIS_CLOUD_URL", "redis://localhost:6379"),
+    })
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.multiplayer_load", "--serve", "--port", str(port)]
+        + (["--fake-redis"] if args.fake_redis else []),
+        env=os.environ.copy()
+    )
+    try:
+        return await drive(args, base_url, ws_base)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="WebSocket clients per room")
+    parser.add_argument("--duration", type=float, default=10, help="race length in seconds")
+    parser.add_argument("--progress-hz", type=float, default=20, help="typing_progress frames per racer per second")
+    parser.add_argument("--chat-every", type=float, default=2, help="seconds between chat lines per racer")
+    parser.add_argument("--fake-redis", action="store_true", help="use an in-memory fakeredis instead of REDIS_CLOUD_URL")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    report = asyncio.run(bench(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
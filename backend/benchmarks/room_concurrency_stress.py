@@ -0,0 +1,89 @@
+"""Concurrency stress test for the atomic room scripts.
+
+Joins and leaves users against one room at the same time and checks that no
+update was lost: the stored user count always matches the member set, every
+joined user has its user hash, and the room (with its index entries) is
+gone once everyone has left. Runs against REDIS_CLOUD_URL; use a scratch
+database.
+
+    python -m benchmarks.room_concurrency_stress --users 100 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("DB_URL", "postgresql://localhost/rapidkeys")
+
+from app.config.redis_config import redis_manager  # noqa: E402
+
+
+def user_data(user_id: str) -> dict:
+    return {"id": user_id, "username": f"user{user_id}", "wpm": 0, "accuracy": 0, "progress": 0, "is_host": False}
+
+
+async def check_room(room_code: str, expected_members: set):
+    client = redis_manager.redis_client
+    members = set(await client.zrange(redis_manager._members_key(room_code), 0, -1))
+    assert members == expected_members, f"members drifted: {len(members)} stored, {len(expected_members)} expected"
+    if not expected_members:
+        assert not await redis_manager.room_exists(room_code), "empty room was not deleted"
+        assert await client.zscore(redis_manager.ROOM_INDEX_KEY, room_code) is None, "deleted room left in index"
+        return
+    user_count = int(await client.hget(redis_manager._room_key(room_code), "user_count"))
+    assert user_count == len(members), f"user_count {user_count} != {len(members)} members"
+    room = await redis_manager.get_room(room_code)
+    assert set(room["users"]) == members, "member without a user hash"
+
+
+async def run_round(room_code: str, users: int, seed: int) -> float:
+    rng = random.Random(seed)
+    await redis_manager.create_room(room_code, {
+        "code": room_code,
+        "creator_id": "0",
+        "created_at": "stress",
+        "race_started": False,
+        "settings": {"mode": "time", "value": 30}
+    })
+    user_ids = [str(i) for i in range(users)]
+
+    start = time.perf_counter()
+    # Everyone joins at once
+    await asyncio.gather(*(redis_manager.add_user_to_room(room_code, u, user_data(u)) for u in user_ids))
+    await check_room(room_code, set(user_ids))
+
+    # Half leave while the other half rejoin, interleaved
+    leaving = set(rng.sample(user_ids, users // 2))
+    operations = [
+        redis_manager.remove_user_from_room(room_code, u) if u in leaving
+        else redis_manager.add_user_to_room(room_code, u, user_data(u))
+        for u in user_ids
+    ]
+    rng.shuffle(operations)
+    await asyncio.gather(*operations)
+    await check_room(room_code, set(user_ids) - leaving)
+
+    # Everyone leaves at once; the last one out deletes the room
+    await asyncio.gather(*(redis_manager.remove_user_from_room(room_code, u) for u in user_ids))
+    elapsed = time.perf_counter() - start
+    await check_room(room_code, set())
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    await redis_manager.load_scripts()
+    for i in range(args.rounds):
+        elapsed = await run_round(f"STRESS{i}", args.users, args.seed + i)
+        operations = args.users * 3 - args.users // 2
+        print(f"round {i}: {operations} joins/leaves by {args.users} users in {elapsed * 1000:.1f}ms - consistent")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -59,6 +59,48 @@ export const getActiveRooms = async (tokenOverride) => {
   }
 };
 
+// Subprotocols offered to the server, preferred first. With the binary one,
+// typing_progress and progress_snapshot travel as little-endian frames
+// (see backend/app/utils/ws_protocol.py); everything else stays JSON.
+const BINARY_SUBPROTOCOL = "rapidkeys.bin.v1";
+const JSON_SUBPROTOCOL = "rapidkeys.json";
+const TYPING_PROGRESS_TAG = 1;
+const PROGRESS_SNAPSHOT_TAG = 2;
+const SNAPSHOT_ENTRY_SIZE = 7;
+
+const clamp = (value, low, high) => Math.max(low, Math.min(high, Math.round(value || 0)));
+
+const encodeTypingProgress = ({ progress, wpm, accuracy }) => {
+  const view = new DataView(new ArrayBuffer(6));
+  view.setUint8(0, TYPING_PROGRESS_TAG);
+  view.setUint8(1, clamp(progress, 0, 0xff));
+  view.setUint16(2, clamp(wpm, 0, 0xffff), true);
+  view.setUint16(4, clamp((accuracy || 0) * 100, 0, 10000), true);
+  return view.buffer;
+};
+
+// Binary snapshots address users by slot; map them back to ids
+const decodeBinaryFrame = (buffer, userIdsBySlot) => {
+  const view = new DataView(buffer);
+  if (view.getUint8(0) !== PROGRESS_SNAPSHOT_TAG) {
+    throw new Error(`Unknown binary frame tag ${view.getUint8(0)}`);
+  }
+  const users = {};
+  const count = view.getUint16(1, true);
+  for (let i = 0, offset = 3; i < count; i++, offset += SNAPSHOT_ENTRY_SIZE) {
+    const slot = view.getUint16(offset, true);
+    const userId = userIdsBySlot.get(slot);
+    if (userId === undefined) continue;
+    users[userId] = {
+      slot,
+      progress: view.getUint8(offset + 2),
+      wpm: view.getUint16(offset + 3, true),
+      accuracy: view.getUint16(offset + 5, true) / 100,
+    };
+  }
+  return { type: "progress_snapshot", users };
+};
+
 // WebSocket connection for real-time multiplayer
 export const connectToRoom = (roomCode, { onMessage, onOpen, onClose, onError }, tokenOverride) => {
   const token = tokenOverride || (typeof localStorage !== "undefined" ? localStorage.getItem("authToken") : null);
@@ -72,7 +114,16 @@ export const connectToRoom = (roomCode, { onMessage, onOpen, onClose, onError },
   const baseURL = axiosClient.defaults.baseURL || window.location.origin;
   const wsBaseURL = baseURL.replace(/^http/, 'ws');
   const wsUrl = `${wsBaseURL}/multiplayer/ws/${encodeURIComponent(roomCode)}?token=${encodeURIComponent(token)}`;
-  const ws = new WebSocket(wsUrl);
+  const ws = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]);
+  ws.binaryType = "arraybuffer";
+  const userIdsBySlot = new Map();
+
+  const trackSlots = (users) => {
+    userIdsBySlot.clear();
+    (users || []).forEach((user) => {
+      if (user.slot !== undefined && user.slot !== null) userIdsBySlot.set(user.slot, user.id);
+    });
+  };
 
   ws.onopen = (event) => {
     onOpen?.(event);
@@ -80,7 +131,16 @@ export const connectToRoom = (roomCode, { onMessage, onOpen, onClose, onError },
 
   ws.onmessage = (event) => {
     try {
+      if (event.data instanceof ArrayBuffer) {
+        onMessage?.(decodeBinaryFrame(event.data, userIdsBySlot));
+        return;
+      }
       const data = JSON.parse(event.data);
+      if (data.type === "room_joined") {
+        trackSlots(Object.values(data.room?.users || {}));
+      } else if (data.type === "user_joined" || data.type === "user_left") {
+        trackSlots(data.room_users);
+      }
       onMessage?.(data);
     } catch (err) {
       console.error('Failed to parse WebSocket message:', err);
@@ -123,7 +183,8 @@ export const connectToRoom = (roomCode, { onMessage, onOpen, onClose, onError },
     ws,
     send: (data) => {
       if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify(data));
+        const binary = ws.protocol === BINARY_SUBPROTOCOL && data.type === "typing_progress";
+        ws.send(binary ? encodeTypingProgress(data) : JSON.stringify(data));
       } else {
         console.warn('WebSocket not open, cannot send:', data);
       }
@@ -3,7 +3,7 @@ import RacingType from './RacingType'
 import { Users, Trophy, Medal, Award, Crown, Zap } from "lucide-react"
 
 const Race = () => {
-    const { users, roomSettings, words, userProgress } = useWebSocket()
+    const { users, roomSettings, words, textSpec, userProgress } = useWebSocket()
     const mode = roomSettings.mode
     const value = roomSettings.value
 
@@ -45,7 +45,7 @@ const Race = () => {
         <div className='flex gap-6 h-screen p-4'>
             {/* Main Typing Section - Takes most width */}
             <div className="flex-1 min-w-0">
-                <RacingType text={words} givenMode={mode} givenWordCount={value} givenTimeCount={value}/>
+                <RacingType text={words} textSpec={textSpec} givenMode={mode} givenWordCount={value} givenTimeCount={value}/>
             </div>
             
             {/* Enhanced Typists Section - Fixed width on right */}
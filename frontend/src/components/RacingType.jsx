@@ -4,10 +4,10 @@ import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip as RechartsToolti
 import { Tooltip as ShadcnTooltip, TooltipContent, TooltipTrigger, TooltipProvider } from "@/components/ui/tooltip"
 import { useWebSocket } from "../contexts/WebSocketContext"
 import { useNavigate, useLocation } from "react-router-dom"
-import { calculateStats } from "../lib/utils"
+import { calculateStats, wordsFromSpec } from "../lib/utils"
 
 
-function RacingType({ text = [], givenMode = "words", givenWordCount = 10, givenTimeCount = 15 }) {
+function RacingType({ text = [], textSpec = null, givenMode = "words", givenWordCount = 10, givenTimeCount = 15 }) {
   const mode = givenMode
   const wordCount = givenWordCount
   const timeCount = givenTimeCount
@@ -209,11 +209,11 @@ function RacingType({ text = [], givenMode = "words", givenWordCount = 10, given
 
   // Keep supplying words in time mode
   useEffect(() => {
-    if (mode === "time" && words.length - currentWordIndex < 20) {
+    if (mode === "time" && textSpec && words.length - currentWordIndex < 20) {
       isAppendingWords.current = true
-      setWords((prev) => [...prev, ...getRandomWords(50)])
+      setWords((prev) => [...prev, ...wordsFromSpec(textSpec, prev.length, 50)])
     }
-  }, [mode, words, currentWordIndex])
+  }, [mode, textSpec, words, currentWordIndex])
 
   // Update display window when user progresses
   useEffect(() => {
@@ -7,6 +7,7 @@ import {
   sendNotification as sendNotificationAPI,
 } from "../api/multiplayer.js";
 import { useNavigate } from "react-router-dom";
+import { wordsFromSpec } from "../lib/utils";
 
 const WebSocketContext = createContext(null);
 
@@ -22,6 +23,7 @@ export const WebSocketProvider = ({ roomCode, children }) => {
     const wsRef = useRef(null)
     const currentUserId = JSON.parse(localStorage.getItem("userData")).id
     const [words, setWords] = useState([])
+    const [textSpec, setTextSpec] = useState(null)
     const [userProgress, setUserProgress] = useState({})
     const [raceStartTime, setRaceStartTime] = useState(null)
     const [connectionError, setConnectionError] = useState(null)
@@ -70,8 +72,13 @@ export const WebSocketProvider = ({ roomCode, children }) => {
                         })
                         break
                     }
+                    case 'progress_snapshot': {
+                        setUserProgress(prev => ({ ...prev, ...(data.users || {}) }))
+                        break
+                    }
                     case 'race_started': {
-                        setWords(data.words)
+                        setTextSpec(data.text)
+                        setWords(wordsFromSpec(data.text))
                         setRaceStarted(true)
                         setRaceStartTime(data.start_time)
                         break
@@ -153,6 +160,7 @@ export const WebSocketProvider = ({ roomCode, children }) => {
             raceStarted,
             hostId,
             words,
+            textSpec,
             userProgress,
             wsRef,
             sendMessage,
@@ -22,6 +22,40 @@ export const COMMON_WORDS = [
   "food", "bread", "rice", "milk", "cheese", "butter", "egg", "meat", "fish", "soup"
 ];
 
+// Versioned word lists; must match CORPORA in backend/app/utils/word_generator.py
+export const CORPORA = {
+  1: COMMON_WORDS,
+};
+
+// Words generated up front for open-ended (time mode) races
+export const TIME_MODE_INITIAL_WORDS = 150;
+
+// mulberry32, kept bit-for-bit identical to the backend generator
+const mulberry32 = (seed) => {
+  let state = seed | 0;
+  return () => {
+    state = (state + 0x6D2B79F5) | 0;
+    let t = Math.imul(state ^ (state >>> 15), state | 1);
+    t = (t + Math.imul(t ^ (t >>> 7), t | 61)) ^ t;
+    return (t ^ (t >>> 14)) >>> 0;
+  };
+};
+
+// Rebuild words [start, start + count) of a race text described by { corpus_version, seed, count }
+export const wordsFromSpec = (text, start = 0, count) => {
+  const corpus = CORPORA[text.corpus_version];
+  if (count === undefined) {
+    count = (text.count ?? TIME_MODE_INITIAL_WORDS) - start;
+  }
+  const next = mulberry32(text.seed);
+  for (let i = 0; i < start; i++) next();
+  const words = [];
+  for (let i = 0; i < count; i++) {
+    words.push(corpus[next() % corpus.length]);
+  }
+  return words;
+};
+
 export const calculateStats = (correctCharCount, incorrectCharCount, elapsedTime, currentWordIndex, words) => {
   const totalChars = correctCharCount + incorrectCharCount
   const accuracy = totalChars === 0 ? 100 : parseFloat(((correctCharCount / totalChars) * 100).toFixed(2))